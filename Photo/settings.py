@@ -51,22 +51,80 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'User.authentication.CachedJWTAuthentication',
     ),
 }
 
+# CachedJWTAuthentication keeps the auth fields of recently seen users in a per-process LRU.
+# Set AUTH_USER_CACHE_ALIAS to a CACHES alias to share entries between processes. An invalidation (deactivation,
+# verification) clears this process's LRU and the shared entry only; other processes may serve their local copy
+# for up to AUTH_USER_CACHE_TTL seconds.
+AUTH_USER_CACHE_SIZE = config('AUTH_USER_CACHE_SIZE', default=10000, cast=int)
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=30, cast=int)
+AUTH_USER_CACHE_ALIAS = config('AUTH_USER_CACHE_ALIAS', default=None)
+
+# 'jwt': API logins only mint tokens, with no Django session written or rotated. 'session': also log the user
+# into a session, for clients that rely on the session cookie.
+AUTH_LOGIN_MODE = config('AUTH_LOGIN_MODE', default='jwt')
+# Sessions are left to the admin. cached_db serves them from SESSION_CACHE_ALIAS and falls back to the table;
+# 'django.contrib.sessions.backends.signed_cookies' stores nothing server side. Run `manage.py purge_sessions`
+# periodically to delete expired rows.
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
+
+# Logged-out JWTs (User.denylist). Each process checks tokens against a Bloom filter sized for CAPACITY
+# revocations at ERROR_RATE false positives, picks up other processes' revocations every SYNC_SECONDS and
+# rebuilds it every REBUILD_SECONDS to drop expired ones. Run `manage.py purge_revoked_tokens` periodically.
+JWT_DENYLIST_CAPACITY = config('JWT_DENYLIST_CAPACITY', default=100000, cast=int)
+JWT_DENYLIST_ERROR_RATE = config('JWT_DENYLIST_ERROR_RATE', default=0.001, cast=float)
+JWT_DENYLIST_SYNC_SECONDS = config('JWT_DENYLIST_SYNC_SECONDS', default=5, cast=int)
+JWT_DENYLIST_REBUILD_SECONDS = config('JWT_DENYLIST_REBUILD_SECONDS', default=3600, cast=int)
+
 MIDDLEWARE = [
+    'User.middleware.InstrumentationMiddleware',
     "corsheaders.middleware.CorsMiddleware",
-    "django.middleware.common.CommonMiddleware",
     'django.middleware.security.SecurityMiddleware',
+    'User.middleware.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'User.middleware.ProfilingMiddleware',
 ]
 
+# Per URL name limits checked by InstrumentationMiddleware; '*' applies to views without their own entry.
+# Requests over budget are logged with their repeated (N+1) and slowest queries.
+PERFORMANCE_BUDGETS = {
+    '*': {'wall_ms': 500, 'queries': 10, 'db_ms': 200},
+    'users_endpoint': {'wall_ms': 200, 'queries': 3, 'db_ms': 50},
+    'users_search_endpoint': {'wall_ms': 50, 'queries': 6, 'db_ms': 10},
+    'login_endpoint': {'wall_ms': 1000, 'queries': 6},
+}
+# The schema API-only workers serve instead of generating it (Photo.settings_api). Build it with the full
+# settings: `python manage.py generate_swagger --overwrite openapi.json`.
+SWAGGER_SETTINGS = {'DEFAULT_INFO': 'Photo.urls.api_info'}
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'openapi.json'
+
+# Bearer token required by the /metrics endpoint. Without one it is only served when DEBUG is on.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Sampling profiler (User.profiling). Off, ProfilingMiddleware removes itself at startup. On, a request is
+# profiled when it carries an X-Profile header from `manage.py profile_header <url name>` (valid for
+# HEADER_MAX_AGE seconds), or at random for SAMPLE_RATE of the requests to PROFILING_VIEWS (all views when
+# empty). At most MAX_CONCURRENT requests per process are profiled at once, every INTERVAL seconds for up to
+# MAX_SECONDS, and the newest MAX_PROFILES are kept in PROFILING_DIR for the staff-only api/profiles/ endpoint.
+# Async views are not profiled (see ProfilingMiddleware).
+PROFILING_ENABLED = config('PROFILING_ENABLED', default=False, cast=bool)
+PROFILING_SAMPLE_RATE = config('PROFILING_SAMPLE_RATE', default=0.0, cast=float)
+PROFILING_VIEWS = {v.strip() for v in config('PROFILING_VIEWS', default='').split(',') if v.strip()}
+PROFILING_HEADER_MAX_AGE = config('PROFILING_HEADER_MAX_AGE', default=3600, cast=int)
+PROFILING_MAX_CONCURRENT = config('PROFILING_MAX_CONCURRENT', default=1, cast=int)
+PROFILING_INTERVAL = config('PROFILING_INTERVAL', default=0.005, cast=float)
+PROFILING_MAX_SECONDS = config('PROFILING_MAX_SECONDS', default=30, cast=float)
+PROFILING_MAX_PROFILES = config('PROFILING_MAX_PROFILES', default=200, cast=int)
+PROFILING_DIR = config('PROFILING_DIR', default=str(BASE_DIR / 'profiles'))
+
 ROOT_URLCONF = 'Photo.urls'
 
 TEMPLATES = [
@@ -103,10 +161,28 @@ DATABASES = {
         'OPTIONS': {
             'sql_mode': 'traditional'
 
-        }
+        },
+        # Keep connections open between requests and ping them before reuse instead of reconnecting every time.
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=300, cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas, as a comma separated list of hosts sharing the primary's credentials. Reads are spread
+# over them by User.routers.PrimaryReplicaRouter; a replica that fails to connect is skipped for
+# DATABASE_REPLICA_RETRY_SECONDS. To try this locally, point several aliases at SQLite files or local
+# MySQL instances and list them in DATABASE_REPLICAS.
+DATABASE_REPLICAS = []
+for _index, _host in enumerate(h.strip() for h in config('DB_REPLICA_HOSTS', default='').split(',') if h.strip()):
+    _alias = f'replica_{_index}'
+    DATABASES[_alias] = {**DATABASES['default'], 'HOST': _host, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(_alias)
+
+DATABASE_ROUTERS = ['User.routers.PrimaryReplicaRouter']
+# After a write, the client's reads stay on the primary for this long to hide replication lag.
+DATABASE_REPLICA_PIN_SECONDS = config('DATABASE_REPLICA_PIN_SECONDS', default=5, cast=int)
+DATABASE_REPLICA_RETRY_SECONDS = config('DATABASE_REPLICA_RETRY_SECONDS', default=30, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -141,6 +217,33 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+# Media is served by User.media.serve_media. Set MEDIA_SENDFILE to 'nginx' (X-Accel-Redirect to an internal
+# location at MEDIA_SENDFILE_PREFIX aliased to MEDIA_ROOT) or 'apache'/'lighttpd' (X-Sendfile) to let the front
+# server send the bytes. Content-addressed files are cached as immutable, the rest for MEDIA_CACHE_MAX_AGE.
+MEDIA_SENDFILE = config('MEDIA_SENDFILE', default='')
+MEDIA_SENDFILE_PREFIX = config('MEDIA_SENDFILE_PREFIX', default='/protected-media/')
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=300, cast=int)
+
+# Avatars are re-encoded off the request thread into these bounding-box sizes (WebP and JPEG, no EXIF).
+AVATAR_RENDITION_SIZES = (64, 256, 1024)
+AVATAR_DEFAULT_SIZE = config('AVATAR_DEFAULT_SIZE', default=256, cast=int)
+# Avatar uploads are checked while they stream in (User.uploads.AvatarUploadHandler) and spooled to
+# FILE_UPLOAD_TEMP_DIR. Keep it outside MEDIA_ROOT, so partial uploads are never served, but on the same
+# filesystem, so that storing a finished upload is a rename rather than a second copy.
+AVATAR_MAX_UPLOAD_SIZE = config('AVATAR_MAX_UPLOAD_SIZE', default=1 * 1024 * 1024 * 1024, cast=int)
+AVATAR_UPLOAD_FIELDS = ('avatar',)
+FILE_UPLOAD_TEMP_DIR = config('FILE_UPLOAD_TEMP_DIR', default=str(BASE_DIR / 'uploads-tmp'))
+# Created here rather than on first upload: Django's system checks (files.E001) reject a missing directory.
+os.makedirs(FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+FILE_UPLOAD_HANDLERS = [
+    'User.uploads.AvatarUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+AVATAR_PROCESSING_WORKERS = config('AVATAR_PROCESSING_WORKERS', default=max(1, (os.cpu_count() or 2) // 2), cast=int)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -157,7 +260,17 @@ CORS_ALLOW_METHODS = (
 
 AUTH_USER_MODEL = 'User.User'
 
+# HS256 signs with SECRET_KEY. For RS*/ES*/EdDSA point JWT_SIGNING_KEY_FILE and JWT_VERIFYING_KEY_FILE at
+# PEM files; they are read here once and parsed once by User.tokens.
+JWT_ALGORITHM = config('JWT_ALGORITHM', default='HS256')
+JWT_SIGNING_KEY_FILE = config('JWT_SIGNING_KEY_FILE', default='')
+JWT_VERIFYING_KEY_FILE = config('JWT_VERIFYING_KEY_FILE', default='')
+
 SIMPLE_JWT = {
+    'ALGORITHM': JWT_ALGORITHM,
+    'SIGNING_KEY': Path(JWT_SIGNING_KEY_FILE).read_text() if JWT_SIGNING_KEY_FILE else SECRET_KEY,
+    'VERIFYING_KEY': Path(JWT_VERIFYING_KEY_FILE).read_text() if JWT_VERIFYING_KEY_FILE else '',
+    'AUTH_TOKEN_CLASSES': ('User.tokens.AccessToken',),
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
     'SLIDING_TOKEN_LIFETIME': timedelta(days=30),
@@ -171,3 +284,87 @@ EMAIL_PORT = config('EMAIL_PORT')
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 EMAIL_USE_TLS = config('EMAIL_USE_TLS')
+
+USER_LIST_PAGE_SIZE = config('USER_LIST_PAGE_SIZE', default=100, cast=int)
+USER_LIST_MAX_PAGE_SIZE = config('USER_LIST_MAX_PAGE_SIZE', default=1000, cast=int)
+USER_SEARCH_TYPEAHEAD_SIZE = config('USER_SEARCH_TYPEAHEAD_SIZE', default=10, cast=int)
+# Rendered user list pages. locmem is per process; use a shared backend (file based, Redis) in
+# production so a write in one worker invalidates the pages cached by the others.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'user_list': {
+        'BACKEND': config('USER_LIST_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('USER_LIST_CACHE_LOCATION', default='user-list'),
+        'TIMEOUT': config('USER_LIST_CACHE_TIMEOUT', default=300, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('USER_LIST_CACHE_MAX_ENTRIES', default=1000, cast=int),
+        },
+    },
+}
+USER_LIST_CACHE_ALIAS = 'user_list'
+USER_LIST_STREAM_CHUNK_SIZE = config('USER_LIST_STREAM_CHUNK_SIZE', default=2000, cast=int)
+
+# Failed logins allowed per (count, window in seconds) before LoginView answers 429 without hashing.
+# 'local' keeps counters in process memory; 'cache' shares them through LOGIN_RATE_LIMIT_CACHE_ALIAS.
+LOGIN_RATE_LIMITS = {
+    'ip': (config('LOGIN_RATE_LIMIT_IP', default=50, cast=int), 300),
+    'email': (config('LOGIN_RATE_LIMIT_EMAIL', default=10, cast=int), 900),
+    'ip_email': (config('LOGIN_RATE_LIMIT_IP_EMAIL', default=5, cast=int), 300),
+}
+LOGIN_RATE_LIMIT_STORE = config('LOGIN_RATE_LIMIT_STORE', default='local')
+LOGIN_RATE_LIMIT_CACHE_ALIAS = config('LOGIN_RATE_LIMIT_CACHE_ALIAS', default='default')
+
+# Login user agents are buffered per process and written in batches (User.useragents).
+USER_AGENT_FLUSH_EVENTS = config('USER_AGENT_FLUSH_EVENTS', default=500, cast=int)
+USER_AGENT_FLUSH_SECONDS = config('USER_AGENT_FLUSH_SECONDS', default=10, cast=float)
+USER_AGENT_MAX_BUFFERED = config('USER_AGENT_MAX_BUFFERED', default=50000, cast=int)
+
+# 'deferred' records logins in memory and writes last_login in batches (User.activity), at most once per user
+# per ACTIVITY_GRANULARITY_SECONDS; set ACTIVITY_CACHE_ALIAS to coalesce across processes too. 'immediate'
+# keeps Django's UPDATE of the user row inside every login.
+ACTIVITY_TRACKING = config('ACTIVITY_TRACKING', default='deferred')
+ACTIVITY_GRANULARITY_SECONDS = config('ACTIVITY_GRANULARITY_SECONDS', default=300, cast=int)
+ACTIVITY_FLUSH_SECONDS = config('ACTIVITY_FLUSH_SECONDS', default=30, cast=float)
+ACTIVITY_FLUSH_BATCH_SIZE = config('ACTIVITY_FLUSH_BATCH_SIZE', default=500, cast=int)
+ACTIVITY_MAX_BUFFERED = config('ACTIVITY_MAX_BUFFERED', default=100000, cast=int)
+ACTIVITY_CACHE_ALIAS = config('ACTIVITY_CACHE_ALIAS', default=None)
+
+FRONTEND_URL = config('FRONTEND_URL', default='http://localhost:3000')
+EMAIL_VERIFICATION_TOKEN_TTL_HOURS = config('EMAIL_VERIFICATION_TOKEN_TTL_HOURS', default=48, cast=int)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='webmaster@localhost')
+
+# Verification mail goes through the OutgoingEmail outbox. Run `manage.py send_queued_mail --loop`
+# as a worker, or let each web process drain the outbox on a background thread after commit; that thread
+# also wakes itself when the earliest failed message is due for its retry.
+MAIL_DISPATCH_IN_PROCESS = config('MAIL_DISPATCH_IN_PROCESS', default=True, cast=bool)
+MAIL_BATCH_SIZE = config('MAIL_BATCH_SIZE', default=50, cast=int)
+MAIL_MAX_ATTEMPTS = config('MAIL_MAX_ATTEMPTS', default=5, cast=int)
+MAIL_RETRY_BACKOFF = config('MAIL_RETRY_BACKOFF', default=30, cast=int)
+MAIL_RETRY_BACKOFF_MAX = config('MAIL_RETRY_BACKOFF_MAX', default=3600, cast=int)
+MAIL_CLAIM_TIMEOUT = config('MAIL_CLAIM_TIMEOUT', default=300, cast=int)
+
+# Password hashing runs on a dedicated pool (see User.hashing). Requests beyond MAX_PENDING queued or
+# running hashes are rejected with 503 + Retry-After instead of piling up behind a login storm.
+# Each web worker (WEB_CONCURRENCY of them, as gunicorn and uvicorn read it) gets its own pool, so by default
+# a worker takes its share of the host's CPUs, one or two processes.
+WEB_CONCURRENCY = config('WEB_CONCURRENCY', default=1, cast=int)
+PASSWORD_HASHING_POOL = config('PASSWORD_HASHING_POOL', default='process')  # 'process' or 'thread'
+PASSWORD_HASHING_WORKERS = config('PASSWORD_HASHING_WORKERS', cast=int,
+                                  default=max(1, min(2, (os.cpu_count() or 1) // max(1, WEB_CONCURRENCY))))
+PASSWORD_HASHING_MAX_PENDING = config('PASSWORD_HASHING_MAX_PENDING', default=4 * PASSWORD_HASHING_WORKERS, cast=int)
+PASSWORD_HASHING_RETRY_AFTER = config('PASSWORD_HASHING_RETRY_AFTER', default=1, cast=int)
+
+# New and upgraded hashes use PASSWORD_HASHER; the others stay listed so existing hashes still verify and
+# are rehashed on the next successful login. argon2 needs argon2-cffi, bcrypt needs bcrypt.
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'bcrypt': 'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+}
+PASSWORD_HASHER = config('PASSWORD_HASHER', default='pbkdf2')
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
@@ -0,0 +1,39 @@
+"""
+Settings for API-only workers: run them with DJANGO_SETTINGS_MODULE=Photo.settings_api.
+
+Everything in Photo.settings applies, minus what these workers never serve: the admin, messages, static
+files, drf_yasg's schema views, the templates behind the browsable API and, with AUTH_LOGIN_MODE 'jwt',
+sessions. A cold worker then imports and checks less before its first request. The OpenAPI schema is pre-generated at build time with the full
+settings (see OPENAPI_SCHEMA_FILE) and served as a file.
+
+Compare the two profiles with `python manage.py bench_startup`.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import AUTH_LOGIN_MODE, INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK
+
+API_DROPPED_APPS = (
+    'django.contrib.admin',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'drf_yasg',
+)
+
+API_DROPPED_MIDDLEWARE = ('django.contrib.messages.middleware.MessageMiddleware',)
+if AUTH_LOGIN_MODE == 'jwt':
+    # Nothing here reads or writes a Django session: DRF and the async views authenticate the JWT themselves.
+    API_DROPPED_APPS += ('django.contrib.sessions',)
+    API_DROPPED_MIDDLEWARE += (
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+    )
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in API_DROPPED_APPS]
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in API_DROPPED_MIDDLEWARE]
+
+ROOT_URLCONF = 'Photo.urls_api'
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer',),
+}
@@ -20,16 +20,20 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from django.conf import settings
 from django.conf.urls.static import static
+from User.media import serve_media
+from User.views import metrics_view
 
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Photos API",
-      default_version='v1',
-      description="Alhamdulillah",
-      contact=openapi.Contact(email="ahwirengfiifi@gmail.com"),
+api_info = openapi.Info(
+   title="Photos API",
+   default_version='v1',
+   description="Alhamdulillah",
+   contact=openapi.Contact(email="ahwirengfiifi@gmail.com"),
+
+)
 
-   ),
+schema_view = get_schema_view(
+   api_info,
    public=True,
 
 )
@@ -37,12 +41,13 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('User.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('api/swagger', schema_view.with_ui('swagger'), name='schema-swagger-ui'),
     path('api/redoc/', schema_view.with_ui('redoc'), name='schema-redoc'),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns.append(path(settings.MEDIA_URL.lstrip('/') + '<path:path>', serve_media, name='media'))
 
 
 
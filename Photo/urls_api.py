@@ -0,0 +1,16 @@
+"""
+URL configuration for API-only workers (Photo.settings_api): the API, metrics, media and the pre-generated schema.
+No admin, Swagger UI or static file routes, and nothing built at import time.
+"""
+from django.conf import settings
+from django.urls import path, include
+from User.media import serve_media
+from User.views import metrics_view, openapi_schema_view
+
+
+urlpatterns = [
+    path('auth/', include('User.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    path('api/openapi.json', openapi_schema_view, name='openapi-schema'),
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', serve_media, name='media'),
+]
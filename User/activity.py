@@ -0,0 +1,155 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, close_old_connections
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityCollector:
+    """
+    Write-behind for User.last_login. A login is recorded at most once per user per ``granularity`` seconds - per
+    process, and across processes when ``alias`` names a shared cache - and the recorded timestamps are written
+    from a background thread every ``flush_seconds`` as one CASE UPDATE per ``batch_size`` users, instead of an
+    UPDATE of the user row inside every login request.
+    """
+
+    def __init__(self, granularity, flush_seconds, batch_size, max_buffered, alias=None):
+        self.granularity = granularity
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.alias = alias
+        self.recorded = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self._buffer = {}
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _seen_recently(self, user_id, now):
+        seen = self._recent.get(user_id)
+        return seen is not None and (now - seen).total_seconds() < self.granularity
+
+    def _mark_seen(self, user_id, now):
+        self._recent[user_id] = now
+        self._recent.move_to_end(user_id)
+        while len(self._recent) > self.max_buffered:
+            self._recent.popitem(last=False)
+
+    def _full(self, user_id):
+        return user_id not in self._buffer and len(self._buffer) >= self.max_buffered
+
+    def record(self, user_id, now=None):
+        now = now or timezone.now()
+        with self._lock:
+            if self._seen_recently(user_id, now):
+                self.coalesced += 1
+                return
+            if self._full(user_id):
+                self.dropped += 1
+                return
+        key = f'activity:{user_id}'
+        # Another process recorded this user within the window.
+        if self.alias and not caches[self.alias].add(key, 1, self.granularity):
+            with self._lock:
+                self._mark_seen(user_id, now)
+                self.coalesced += 1
+            return
+        with self._lock:
+            # The user only counts as seen once the login is buffered; a dropped one must not hide the next.
+            dropped = self._full(user_id)
+            if dropped:
+                self.dropped += 1
+            else:
+                self._buffer[user_id] = now
+                self._mark_seen(user_id, now)
+                self.recorded += 1
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='activity-flush', daemon=True)
+                    self._thread.start()
+        if dropped and self.alias:
+            caches[self.alias].delete(key)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing last_login timestamps failed')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        from .listcache import bump_activity_version
+        from .models import User
+
+        with self._lock:
+            batch, self._buffer = self._buffer, {}
+        if not batch:
+            return 0
+
+        updated = written = 0
+        user_ids = sorted(batch)
+        try:
+            # Ascending ids: concurrent flushes from several processes lock rows in the same order.
+            for i in range(0, len(user_ids), self.batch_size):
+                chunk = user_ids[i:i + self.batch_size]
+                seen = Case(*[When(pk=pk, then=Value(batch[pk])) for pk in chunk], output_field=DateTimeField())
+                # Never move last_login backwards if another process flushed a later login first.
+                updated += User.objects.filter(pk__in=chunk).update(
+                    last_login=Greatest(Coalesce(F('last_login'), seen), seen))
+                written += len(chunk)
+        except DatabaseError:
+            # Keep the logins of the chunks not written for the next flush; their users count as seen already.
+            self._requeue({pk: batch[pk] for pk in user_ids[written:]})
+            raise
+        finally:
+            # Each chunk commits on its own, so the pages listing them are stale even if a later one failed.
+            if updated:
+                bump_activity_version()
+        return updated
+
+    def _requeue(self, batch):
+        with self._lock:
+            for user_id, seen_at in batch.items():
+                if user_id in self._buffer:
+                    self._buffer[user_id] = max(self._buffer[user_id], seen_at)
+                elif len(self._buffer) < self.max_buffered:
+                    self._buffer[user_id] = seen_at
+                else:
+                    self.dropped += 1
+
+    def stats(self):
+        with self._lock:
+            return {'recorded': self.recorded, 'coalesced': self.coalesced, 'dropped': self.dropped,
+                    'buffered': len(self._buffer)}
+
+
+collector = ActivityCollector(settings.ACTIVITY_GRANULARITY_SECONDS, settings.ACTIVITY_FLUSH_SECONDS,
+                              settings.ACTIVITY_FLUSH_BATCH_SIZE, settings.ACTIVITY_MAX_BUFFERED,
+                              settings.ACTIVITY_CACHE_ALIAS)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        collector.flush()
+    except Exception:
+        logger.exception('Flushing last_login timestamps at exit failed')
+
+
+def record_login(sender, user, **kwargs):
+    """``user_logged_in`` receiver used in place of django.contrib.auth's update_last_login."""
+    collector.record(user.pk)
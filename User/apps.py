@@ -1,6 +1,25 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class UserConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'User'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+
+        from . import signals
+        from .metrics import install_query_recorder
+
+        post_migrate.connect(signals.create_search_index, sender=self)
+        connection_created.connect(install_query_recorder, dispatch_uid='install_query_recorder')
+
+        if settings.ACTIVITY_TRACKING == 'deferred':
+            from django.contrib.auth.signals import user_logged_in
+
+            from .activity import record_login
+
+            user_logged_in.disconnect(dispatch_uid='update_last_login')
+            user_logged_in.connect(record_login, dispatch_uid='record_login')
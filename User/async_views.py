@@ -0,0 +1,176 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import alogin, alogout
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from . import hashing, listcache, pagination
+from .denylist import denylist
+from .tokens import RefreshToken, issued_to
+from .mailer import queue_mail
+from .models import EmailVerificationToken, User
+from .serializer import UserRegistrationSerializer, UserRowSerializer
+from .ratelimit import client_ip, login_throttle
+from .useragents import record_user_agent
+from .views import access_only, get_tokens_for_user, verification_email
+
+def _json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def aauthenticate(request):
+    """Async counterpart of JWTAuthentication.authenticate: token checks are CPU only, the user lookup is awaited."""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+    if not raw_token:
+        return None
+    try:
+        token = authentication.get_validated_token(raw_token)
+        if await denylist.ais_revoked(token.get(api_settings.JTI_CLAIM)):
+            return None
+        user = await User.objects.aget(**{api_settings.USER_ID_FIELD: token[api_settings.USER_ID_CLAIM]})
+    except (InvalidToken, TokenError, AuthenticationFailed, KeyError, User.DoesNotExist):
+        return None
+    request.auth = token
+    return user if user.is_active else None
+
+
+def _overloaded(exc):
+    response = JsonResponse({'msg': str(exc.detail)}, status=exc.status_code)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+def _unauthorized():
+    return JsonResponse({'msg': 'Authentication credentials were not provided or are invalid'},
+                        status=status.HTTP_401_UNAUTHORIZED)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLoginView(View):
+    async def post(self, request):
+        data = _json_body(request) or {}
+        email = data.get('email')
+        password = data.get('password')
+
+        if not isinstance(email, str) or not isinstance(password, str) or not email or not password:
+            return JsonResponse({'msg': 'Credentials missing'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ip = client_ip(request)
+        # The throttle's counters live in the cache, whose client blocks.
+        wait = await sync_to_async(login_throttle.check)(ip, email)
+        if wait is not None:
+            response = JsonResponse({'msg': 'Too many failed logins'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(wait)
+            return response
+
+        # Through AUTHENTICATION_BACKENDS and user_login_failed like LoginView; the hash runs on User.hashing's pool.
+        try:
+            user = await auth.aauthenticate(request, email=email, password=password)
+        except hashing.HashingOverloaded as exc:
+            return _overloaded(exc)
+
+        if user is not None:
+            await sync_to_async(login_throttle.succeeded)(ip, email)
+            if settings.AUTH_LOGIN_MODE == 'session':
+                await alogin(request, user, backend='django.contrib.auth.backends.ModelBackend')
+            else:
+                await user_logged_in.asend(sender=user.__class__, request=request, user=user)
+            record_user_agent(request, user)
+            tokens = get_tokens_for_user(user, refresh=not access_only(data))
+            return JsonResponse({'msg': 'Login Success', 'tokens': tokens}, status=status.HTTP_200_OK)
+
+        await sync_to_async(login_throttle.failed)(ip, email)
+        return JsonResponse({'msg': 'Invalid Credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncLogoutView(View):
+    async def post(self, request):
+        user = await aauthenticate(request)
+        if user is None:
+            return _unauthorized()
+        raw, refresh = (_json_body(request) or {}).get('refresh'), None
+        if raw:
+            try:
+                refresh = RefreshToken(raw)
+            except TokenError:
+                pass
+        if refresh is not None and not issued_to(refresh, user):
+            return JsonResponse({'msg': 'Refresh token was issued to another user'}, status=status.HTTP_403_FORBIDDEN)
+        await denylist.arevoke(request.auth)
+        if refresh is not None:
+            await denylist.arevoke(refresh)
+        if settings.AUTH_LOGIN_MODE == 'session':
+            await alogout(request)
+        return JsonResponse({'msg': 'Successfully Logged out'}, status=status.HTTP_200_OK)
+
+
+def _register(user):
+    # One transaction, as in RegistrationView: a failure part way leaves no inactive user without its token or mail.
+    with transaction.atomic():
+        user.save()
+        queue_mail(*verification_email(user, EmailVerificationToken.issue(user)))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncRegistrationView(View):
+    async def post(self, request):
+        data = _json_body(request)
+        if data is None:
+            return JsonResponse({'msg': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Same validation as RegistrationView; only the hashing and the writes stay on the event loop.
+        serializer = UserRegistrationSerializer(data=data)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        user = serializer.build_user()
+        try:
+            user.password = await hashing.amake_password(serializer.validated_data['password'])
+        except hashing.HashingOverloaded as exc:
+            return _overloaded(exc)
+        await sync_to_async(_register)(user)
+        serializer.instance = user
+        return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class AsyncUserList(View):
+    async def get(self, request):
+        if await aauthenticate(request) is None:
+            return _unauthorized()
+        try:
+            serializer = UserRowSerializer(pagination.parse_fields(request.GET.get('fields')), request)
+            users = serializer.project(pagination.keyset(User.objects.all(), request.GET.get('cursor')))
+
+            stream = request.GET.get('stream')
+            if stream:
+                return pagination.astream_response(users, serializer, stream)
+
+            page_size = pagination.parse_page_size(request.GET.get('page_size'))
+        except ValidationError as exc:
+            return JsonResponse(exc.detail, status=status.HTTP_400_BAD_REQUEST)
+
+        key = await listcache.acache_key(request)
+        entry = await listcache.aget(key)
+        if entry is None:
+            page = await pagination.afetch_page(users, serializer, page_size)
+            entry = await listcache.astore(key, page, pagination.next_page_headers(request, page.next_cursor))
+        return listcache.respond(request, entry)
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from django.db.models import DEFERRED
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .denylist import denylist
+from .models import User
+
+# Only what authentication and the default permission classes look at; everything else is deferred.
+AUTH_USER_FIELDS = ('id', 'email', 'is_active', 'is_staff')
+
+
+class UserCache:
+    """Per-process LRU of auth fields with a short TTL, optionally backed by a shared Django cache."""
+
+    def __init__(self, maxsize, ttl, alias=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.alias = alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, pk):
+        # v2: entries are {field: value} dicts.
+        return f'auth-user:v2:{pk}'
+
+    def get(self, pk):
+        # Token claims carry the id as a string, model signals as an int: key both the same way.
+        pk = str(pk)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(pk)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[pk]
+        values = caches[self.alias].get(self._key(pk)) if self.alias else None
+        with self._lock:
+            if values is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._store(pk, values, now)
+        return values
+
+    def set(self, pk, values):
+        pk = str(pk)
+        with self._lock:
+            self._store(pk, values, time.monotonic())
+        if self.alias:
+            caches[self.alias].set(self._key(pk), values, self.ttl)
+
+    def _store(self, pk, values, now):
+        self._entries[pk] = (now + self.ttl, values)
+        self._entries.move_to_end(pk)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, pk):
+        pk = str(pk)
+        with self._lock:
+            self._entries.pop(pk, None)
+        if self.alias:
+            caches[self.alias].delete(self._key(pk))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+user_cache = UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL, settings.AUTH_USER_CACHE_ALIAS)
+
+
+def cached_user(values):
+    """A User with the cached fields set by name and the others deferred, as ``.only(*AUTH_USER_FIELDS)`` gives."""
+    user = User(**{field.attname: values.get(field.attname, DEFERRED) for field in User._meta.concrete_fields})
+    user._state.adding = False
+    user._state.db = router.db_for_read(User)
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that rejects logged-out tokens (:data:`User.denylist.denylist`) and serves the token's user
+    from :data:`user_cache` instead of a query per request.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if denylist.is_revoked(token.get(api_settings.JTI_CLAIM)):
+            raise InvalidToken(_('Token has been revoked'))
+        return token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        values = user_cache.get(user_id)
+        if values is None:
+            try:
+                user = User.objects.only(*AUTH_USER_FIELDS).get(**{api_settings.USER_ID_FIELD: user_id})
+            except User.DoesNotExist:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            user_cache.set(user_id, {field: getattr(user, field) for field in AUTH_USER_FIELDS})
+        else:
+            # Other fields stay deferred and are loaded on first access, like any .only() instance.
+            user = cached_user(values)
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
@@ -0,0 +1,115 @@
+import logging
+import os
+
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.utils import timezone
+
+from .models import Blob
+from .storage import BLOB_PREFIX, blob_storage
+
+logger = logging.getLogger(__name__)
+
+
+def _is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX + '/')
+
+
+def add_reference(name):
+    if not _is_blob(name):
+        return
+    if not Blob.objects.filter(name=name).update(refcount=F('refcount') + 1, unreferenced_at=None):
+        # Collected between the save and this reference; the storage wrote the file again, so track it again.
+        Blob.objects.get_or_create(name=name, defaults={
+            'size': blob_storage.size(name), 'refcount': 1, 'unreferenced_at': None})
+
+
+def drop_reference(name):
+    if not _is_blob(name):
+        return
+    # unreferenced_at first: MySQL evaluates SET left to right, so it must still see the old refcount.
+    Blob.objects.filter(name=name).update(
+        unreferenced_at=Case(When(refcount__lte=1, then=Value(timezone.now())), default=F('unreferenced_at')),
+        refcount=F('refcount') - 1,
+    )
+
+
+def track_blob_field(model, field_name):
+    """
+    Keep Blob.refcount in step with ``model.<field_name>`` through model signals. Writes that bypass them
+    (``QuerySet.update``, ``bulk_create``) must call add_reference / drop_reference themselves.
+    """
+    uid = f'blob-refs:{model._meta.label}.{field_name}'
+    attname = model._meta.get_field(field_name).attname
+    loaded_key, previous_key = f'_loaded_{field_name}', f'_previous_{field_name}'
+
+    def remember_loaded(sender, instance, **kwargs):
+        # The name as read from the database (absent when the field was deferred), so saves that leave the
+        # field alone need no query to find that out.
+        if attname in instance.__dict__:
+            value = instance.__dict__[attname]
+            instance.__dict__[loaded_key] = getattr(value, 'name', value) or ''
+
+    def remember_previous(sender, instance, update_fields=None, **kwargs):
+        instance.__dict__.pop(previous_key, None)
+        if update_fields is not None and field_name not in update_fields:
+            return
+        current = getattr(instance, field_name).name or ''
+        if instance.pk is None or instance._state.adding:
+            previous = ''
+        elif instance.__dict__.get(loaded_key) == current:
+            return
+        else:
+            previous = sender._default_manager.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+        instance.__dict__[previous_key] = previous or ''
+
+    def count_references(sender, instance, **kwargs):
+        current = getattr(instance, field_name).name or ''
+        instance.__dict__[loaded_key] = current
+        if previous_key not in instance.__dict__:
+            return
+        previous = instance.__dict__.pop(previous_key)
+        if previous != current:
+            add_reference(current)
+            drop_reference(previous)
+
+    def release(sender, instance, **kwargs):
+        drop_reference(getattr(instance, field_name).name)
+
+    post_init.connect(remember_loaded, sender=model, weak=False, dispatch_uid=uid + ':post_init')
+    pre_save.connect(remember_previous, sender=model, weak=False, dispatch_uid=uid + ':pre_save')
+    post_save.connect(count_references, sender=model, weak=False, dispatch_uid=uid + ':post_save')
+    post_delete.connect(release, sender=model, weak=False, dispatch_uid=uid + ':post_delete')
+
+
+def _delete_files(blob):
+    names = [blob.name] + [name for size, formats in blob.renditions.items() if size != 'source'
+                           for name in formats.values()]
+    for name in names:
+        try:
+            blob_storage.delete(name)
+        except OSError:
+            logger.warning('Could not delete %s', name, exc_info=True)
+    # Prune the emptied shard directories (blobs/ab/cd), never anything above them.
+    directory = os.path.dirname(blob_storage.path(blob.name))
+    for path in (directory, os.path.dirname(directory)):
+        try:
+            os.rmdir(path)
+        except OSError:
+            break
+
+
+def collect_batch(grace, batch_size):
+    """Delete up to ``batch_size`` blobs unreferenced for longer than ``grace``; return how many were removed."""
+    cutoff = timezone.now() - grace
+    with transaction.atomic():
+        # skip_locked: blobs being re-uploaded right now hold their row lock (see ContentAddressedStorage).
+        blobs = list(Blob.objects.select_for_update(skip_locked=True)
+                     .filter(refcount__lte=0, unreferenced_at__lte=cutoff)
+                     .order_by('unreferenced_at')[:batch_size])
+        for blob in blobs:
+            _delete_files(blob)
+        Blob.objects.filter(pk__in=[blob.pk for blob in blobs]).delete()
+    return len(blobs)
+
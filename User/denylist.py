@@ -0,0 +1,150 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import RevokedToken
+
+# Logged-out tokens are stored as RevokedToken rows that live only until the token's own exp. Every process
+# keeps a Bloom filter of the revoked jtis, so the check for a token that was never revoked - nearly all of
+# them - is a few bit tests and no I/O. Only filter hits (revoked tokens and rare false positives) are
+# confirmed against the table. Revocations made by other processes reach the filter within
+# JWT_DENYLIST_SYNC_SECONDS.
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class Denylist:
+    def __init__(self, capacity, error_rate, sync_seconds, rebuild_seconds):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_seconds = sync_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self._lock = threading.Lock()
+        self._filter = None
+        self._entries = 0
+        self._synced_at = None
+        self._next_sync = 0.0
+        self._next_rebuild = 0.0
+        self.checks = 0
+        self.lookups = 0
+        self.revoked = 0
+
+    def _stale(self):
+        return self._filter is None or time.monotonic() >= self._next_sync
+
+    def sync(self):
+        """Add revocations recorded since the last sync; rebuild from scratch to shed expired ones."""
+        now = time.monotonic()
+        with self._lock:
+            if self._filter is not None and now < self._next_sync:
+                return
+            rebuild = (self._filter is None or now >= self._next_rebuild
+                       or self._entries >= self._filter.capacity)
+            wall = timezone.now()
+            rows = RevokedToken.objects.using(DEFAULT_DB_ALIAS).filter(expires_at__gt=wall)
+            if not rebuild:
+                # Overlap the previous sync so a revocation committed just after it is not missed.
+                rows = rows.filter(revoked_at__gte=self._synced_at - timedelta(seconds=self.sync_seconds))
+            jtis = list(rows.values_list('jti', flat=True))
+            if rebuild:
+                # Sized with headroom if more tokens are revoked than expected, to keep the false positive rate.
+                self._filter = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+                self._entries = 0
+                self._next_rebuild = now + self.rebuild_seconds
+            for jti in jtis:
+                self._filter.add(jti)
+            self._entries += len(jtis)
+            self._synced_at = wall
+            self._next_sync = now + self.sync_seconds
+
+    def _add(self, jti):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+                self._entries += 1
+
+    def _prepare(self, token):
+        jti = token.get(api_settings.JTI_CLAIM)
+        expires_at = datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+        if not jti or expires_at <= timezone.now():
+            return None
+        return RevokedToken(jti=jti, expires_at=expires_at)
+
+    def revoke(self, token):
+        entry = self._prepare(token)
+        if entry is not None:
+            RevokedToken.objects.bulk_create([entry], ignore_conflicts=True)
+            self._add(entry.jti)
+
+    async def arevoke(self, token):
+        entry = self._prepare(token)
+        if entry is not None:
+            await RevokedToken.objects.abulk_create([entry], ignore_conflicts=True)
+            self._add(entry.jti)
+
+    def _query(self, jti):
+        return RevokedToken.objects.using(DEFAULT_DB_ALIAS).filter(jti=jti, expires_at__gt=timezone.now())
+
+    def _passes(self, jti):
+        self.checks += 1
+        if not jti or jti not in self._filter:
+            return True
+        self.lookups += 1
+        return False
+
+    def is_revoked(self, jti):
+        if self._stale():
+            self.sync()
+        if self._passes(jti):
+            return False
+        revoked = self._query(jti).exists()
+        self.revoked += revoked
+        return revoked
+
+    async def ais_revoked(self, jti):
+        if self._stale():
+            await sync_to_async(self.sync)()
+        if self._passes(jti):
+            return False
+        revoked = await self._query(jti).aexists()
+        self.revoked += revoked
+        return revoked
+
+    def stats(self):
+        return {'checks': self.checks, 'lookups': self.lookups, 'revoked': self.revoked, 'entries': self._entries}
+
+
+denylist = Denylist(
+    settings.JWT_DENYLIST_CAPACITY,
+    settings.JWT_DENYLIST_ERROR_RATE,
+    settings.JWT_DENYLIST_SYNC_SECONDS,
+    settings.JWT_DENYLIST_REBUILD_SECONDS,
+)
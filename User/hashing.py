@@ -0,0 +1,205 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, identify_hasher, is_password_usable
+from django.contrib.auth.hashers import make_password as _make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Password hashing (PBKDF2 by default) is deliberately slow, so it runs on a dedicated pool instead of on
+# request threads or the event loop. Every web worker has its own pool, so PASSWORD_HASHING_WORKERS is the share
+# of the host's CPUs one worker may use. Work beyond PASSWORD_HASHING_MAX_PENDING is
+# rejected immediately with a 503 rather than queued behind a login storm.
+
+
+class HashingOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many password checks in progress, try again shortly.'
+    default_code = 'hashing_overloaded'
+
+    def __init__(self, wait):
+        super().__init__()
+        # DRF's exception handler turns ``wait`` into a Retry-After header.
+        self.wait = wait
+
+
+class HashingMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.completed = 0
+            self.rejected = 0
+            self.in_flight = 0
+            self.hash_seconds = 0.0
+            self.hash_seconds_max = 0.0
+            self.queue_seconds = 0.0
+            self.queue_seconds_max = 0.0
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, queue_seconds, hash_seconds):
+        with self._lock:
+            self.completed += 1
+            self.hash_seconds += hash_seconds
+            self.hash_seconds_max = max(self.hash_seconds_max, hash_seconds)
+            self.queue_seconds += queue_seconds
+            self.queue_seconds_max = max(self.queue_seconds_max, queue_seconds)
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'in_flight': self.in_flight,
+                'hash_seconds_total': self.hash_seconds,
+                'hash_seconds_max': self.hash_seconds_max,
+                'queue_seconds_total': self.queue_seconds,
+                'queue_seconds_max': self.queue_seconds_max,
+            }
+
+
+metrics = HashingMetrics()
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _slots
+    if _executor is None:
+        with _executor_lock:
+            if _slots is None:
+                _slots = threading.BoundedSemaphore(settings.PASSWORD_HASHING_MAX_PENDING)
+            if _executor is None:
+                workers = settings.PASSWORD_HASHING_WORKERS
+                if settings.PASSWORD_HASHING_POOL == 'process':
+                    # spawn, not fork: web workers are multi-threaded and children only need settings.
+                    _executor = ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+    return _executor
+
+
+def _discard_executor(broken):
+    """Drop a pool whose child died so that the next submit starts a fresh one."""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown():
+    """Stop the pool and forget it, with the pending-work limit; the next hash starts both again."""
+    global _executor, _slots
+    with _executor_lock:
+        executor, _executor, _slots = _executor, None, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _timed(func, *args):
+    started = time.time()
+    result = func(*args)
+    return result, started, time.time()
+
+
+def _verify(password, encoded):
+    """Return ``(valid, must_update)``, as Django's check_password does before calling its setter."""
+    if password is None or not is_password_usable(encoded):
+        return False, False
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False, False
+    valid = hasher.verify(password, encoded)
+    preferred = get_hasher('default')
+    must_update = valid and (hasher.algorithm != preferred.algorithm or preferred.must_update(encoded))
+    return valid, must_update
+
+
+def _submit(func, *args):
+    executor = _get_executor()
+    if not _slots.acquire(blocking=False):
+        metrics.reject()
+        raise HashingOverloaded(wait=settings.PASSWORD_HASHING_RETRY_AFTER)
+    submitted = time.time()
+    metrics.start()
+    try:
+        future = executor.submit(_timed, func, *args)
+    except BaseException as exc:
+        metrics.finish()
+        _slots.release()
+        if isinstance(exc, BrokenProcessPool):
+            _discard_executor(executor)
+        raise
+
+    def done(f):
+        metrics.finish()
+        _slots.release()
+        if f.cancelled():
+            return
+        if isinstance(f.exception(), BrokenProcessPool):
+            _discard_executor(executor)
+        elif f.exception() is None:
+            _, started, finished = f.result()
+            metrics.record(max(0.0, started - submitted), finished - started)
+
+    future.add_done_callback(done)
+    return future
+
+
+def _run(func, *args):
+    try:
+        return _submit(func, *args).result()[0]
+    except BrokenProcessPool:
+        # A crashed child breaks the whole pool; the callback has replaced it, so retry once on the new one.
+        return _submit(func, *args).result()[0]
+
+
+async def _arun(func, *args):
+    try:
+        return (await asyncio.wrap_future(_submit(func, *args)))[0]
+    except BrokenProcessPool:
+        return (await asyncio.wrap_future(_submit(func, *args)))[0]
+
+
+def make_password(password):
+    if password is None:
+        return _make_password(None)
+    return _run(_make_password, password)
+
+
+def verify_password(password, encoded):
+    """``(valid, must_update)`` for ``password`` against the stored hash ``encoded``."""
+    return _run(_verify, password, encoded)
+
+
+async def amake_password(password):
+    if password is None:
+        return _make_password(None)
+    return await _arun(_make_password, password)
+
+
+async def averify_password(password, encoded):
+    return await _arun(_verify, password, encoded)
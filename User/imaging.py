@@ -0,0 +1,136 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+RENDITION_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def encoder_tag(pil_format, options):
+    return hashlib.blake2b(repr((pil_format, sorted(options.items()))).encode(), digest_size=4).hexdigest()
+
+
+# Part of every rendition name, so new encoder options give new names and copies cached as immutable (see
+# User.media) are never stale.
+RENDITION_TAGS = {extension: encoder_tag(pil_format, options)
+                  for extension, (pil_format, _, options) in RENDITION_FORMATS.items()}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=settings.AVATAR_PROCESSING_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def rendition_name(source, size, extension):
+    stem = posixpath.splitext(source)[0]
+    return f'renditions/{stem}/{size}-{RENDITION_TAGS[extension]}.{extension}'
+
+
+def render_avatar(source):
+    """Decode ``source`` once and store every configured size/format without EXIF. Runs in a pool worker."""
+    with default_storage.open(source, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    renditions = {'source': source}
+    for size in sorted(settings.AVATAR_RENDITION_SIZES):
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        renditions[str(size)] = {}
+        for extension, (pil_format, _, options) in RENDITION_FORMATS.items():
+            frame = resized.convert('RGB') if pil_format == 'JPEG' and resized.mode != 'RGB' else resized
+            buffer = io.BytesIO()
+            # No exif= argument, so the metadata (GPS, camera serials, ...) is not carried over.
+            frame.save(buffer, pil_format, **options)
+            name = rendition_name(source, size, extension)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            renditions[str(size)][extension] = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return renditions
+
+
+def schedule_renditions(user_pk, source):
+    from .listcache import bump_version
+    from .models import Blob, User
+
+    # The same bytes uploaded before share the blob, and so its renditions: attach them without rendering.
+    renditions = Blob.objects.filter(name=source).values_list('renditions', flat=True).first()
+    if renditions and renditions.get('source') == source:
+        if User.objects.filter(pk=user_pk, avatar=source).update(avatar_renditions=renditions):
+            bump_version()
+        return None
+
+    future = _get_executor().submit(render_avatar, source)
+
+    def done(f):
+        # exception() raises CancelledError on a cancelled future, so check that first.
+        if f.cancelled():
+            logger.warning('Rendering avatar %s was cancelled', source)
+            return
+        if f.exception() is not None:
+            logger.error('Rendering avatar %s failed', source, exc_info=f.exception())
+            return
+        close_old_connections()
+        try:
+            Blob.objects.filter(name=source).update(renditions=f.result())
+            # Only attach if the avatar was not replaced while we were rendering.
+            if User.objects.filter(pk=user_pk, avatar=source).update(avatar_renditions=f.result()):
+                bump_version()
+        finally:
+            close_old_connections()
+
+    future.add_done_callback(done)
+    return future
+
+
+def requested_rendition(request):
+    """The avatar size and format a client asked for, via ``?avatar_size=`` and the Accept header."""
+    size = settings.AVATAR_DEFAULT_SIZE
+    extension = 'jpeg'
+    if request is not None:
+        try:
+            size = int(request.GET.get('avatar_size', size))
+        except ValueError:
+            pass
+        if 'image/webp' in request.META.get('HTTP_ACCEPT', ''):
+            extension = 'webp'
+    return size, extension
+
+
+def avatar_url(name, renditions, size, extension, request=None):
+    if not name:
+        return None
+    path = name
+    if renditions and renditions.get('source') == name:
+        sizes = sorted(int(s) for s in renditions if s != 'source')
+        # Smallest rendition that covers the requested size, else the largest we have.
+        chosen = next((s for s in sizes if s >= size), sizes[-1] if sizes else None)
+        if chosen is not None:
+            path = renditions[str(chosen)].get(extension, path)
+    url = default_storage.url(path)
+    return request.build_absolute_uri(url) if request is not None else url
@@ -0,0 +1,120 @@
+import hashlib
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .metrics import serializer_timer
+from .serializer import dumps
+
+# Cached user list pages are keyed on a table version that post_save/post_delete (and the bulk writers that
+# bypass them) bump, so a write makes every older entry unreachable; the backend's eviction drops them.
+# last_login has a version of its own: logins only invalidate the pages that list it.
+VERSION_KEY = 'users:version'
+ACTIVITY_VERSION_KEY = 'users:activity-version'
+
+CacheKey = namedtuple('CacheKey', ['name', 'last_modified'])
+
+
+def _cache():
+    return caches[settings.USER_LIST_CACHE_ALIAS]
+
+
+def bump_version(key=VERSION_KEY):
+    cache = _cache()
+    # The bump time in ns, so a version doubles as the Last-Modified of the pages built from it (deletes
+    # included), kept increasing so that a version evicted and re-created never repeats an old value.
+    cache.set(key, max(time.time_ns(), (cache.get(key) or 0) + 1), None)
+
+
+def bump_activity_version():
+    bump_version(ACTIVITY_VERSION_KEY)
+
+
+def _version(cache, key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+async def _aversion(cache, key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+def _lists_activity(request):
+    return 'last_login' in request.GET.get('fields', '')
+
+
+def _key(request, versions):
+    # Everything the body depends on: query, host (absolute URLs) and the avatar format negotiated from Accept.
+    webp = 'image/webp' in request.META.get('HTTP_ACCEPT', '')
+    parts = (versions, request.get_host(), request.path, sorted(request.GET.lists()), webp)
+    name = 'users:list:' + hashlib.sha256(repr(parts).encode()).hexdigest()
+    return CacheKey(name, max(versions) // 10 ** 9)
+
+
+def cache_key(request):
+    cache = _cache()
+    keys = (VERSION_KEY, ACTIVITY_VERSION_KEY) if _lists_activity(request) else (VERSION_KEY,)
+    return _key(request, tuple(_version(cache, key) for key in keys))
+
+
+async def acache_key(request):
+    cache = _cache()
+    keys = (VERSION_KEY, ACTIVITY_VERSION_KEY) if _lists_activity(request) else (VERSION_KEY,)
+    return _key(request, tuple([await _aversion(cache, key) for key in keys]))
+
+
+def get(key):
+    return _cache().get(key.name)
+
+
+async def aget(key):
+    return await _cache().aget(key.name)
+
+
+def _entry(key, page, headers):
+    with serializer_timer():
+        body = dumps(page.results)
+    return {
+        'body': body,
+        'etag': '"%s"' % hashlib.sha256(body).hexdigest(),
+        'last_modified': key.last_modified,
+        'headers': headers,
+    }
+
+
+def store(key, page, headers):
+    entry = _entry(key, page, headers)
+    _cache().set(key.name, entry)
+    return entry
+
+
+async def astore(key, page, headers):
+    entry = _entry(key, page, headers)
+    await _cache().aset(key.name, entry)
+    return entry
+
+
+def respond(request, entry):
+    """A 304 if the client's validators still match ``entry``, otherwise the cached body."""
+    response = get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'])
+    if response is None:
+        response = HttpResponse(entry['body'], content_type='application/json')
+        for header, value in entry['headers'].items():
+            response[header] = value
+    response['ETag'] = entry['etag']
+    if entry['last_modified']:
+        response['Last-Modified'] = http_date(entry['last_modified'])
+    response['Cache-Control'] = 'private, no-cache'
+    return response
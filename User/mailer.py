@@ -0,0 +1,133 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+_dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mail-dispatch')
+# Wakes the dispatcher when the earliest backed-off message is due, so retries happen without a worker.
+_retry_lock = threading.Lock()
+_retry_timer = None
+_retry_at = None
+
+
+def queue_mail(subject, body, from_email, recipient_list):
+    """Store a message in the outbox; it is sent by :func:`dispatch_pending` once the transaction commits."""
+    email = OutgoingEmail.objects.create(subject=subject, body=body, from_email=from_email, to=list(recipient_list))
+    if settings.MAIL_DISPATCH_IN_PROCESS:
+        transaction.on_commit(lambda: _dispatcher.submit(_dispatch_in_thread))
+    return email
+
+
+async def aqueue_mail(subject, body, from_email, recipient_list):
+    # On the thread, and so the connection and transaction, that the caller's other writes use.
+    return await sync_to_async(queue_mail)(subject, body, from_email, recipient_list)
+
+
+def _dispatch_in_thread():
+    close_old_connections()
+    try:
+        while any(dispatch_pending()):
+            pass
+        _schedule_retry()
+    except Exception:
+        logger.exception('In-process mail dispatch failed')
+    finally:
+        close_old_connections()
+
+
+def _retry_due():
+    global _retry_timer, _retry_at
+    with _retry_lock:
+        _retry_timer = _retry_at = None
+    _dispatcher.submit(_dispatch_in_thread)
+
+
+def _schedule_retry():
+    """Arm the retry timer for the earliest pending message (backed off, or leased by a send that never finished)."""
+    global _retry_timer, _retry_at
+    due = OutgoingEmail.objects.filter(status=OutgoingEmail.PENDING).aggregate(due=Min('next_attempt_at'))['due']
+    if due is None:
+        return
+    with _retry_lock:
+        if _retry_at is not None and _retry_at <= due:
+            return
+        if _retry_timer is not None:
+            _retry_timer.cancel()
+        _retry_timer = threading.Timer(max(0.0, (due - timezone.now()).total_seconds()), _retry_due)
+        _retry_timer.daemon = True
+        _retry_at = due
+        _retry_timer.start()
+
+
+def _claim_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutgoingEmail.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        # Lease the rows so a concurrent worker does not pick them up while we talk to the relay.
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in batch]).update(
+            next_attempt_at=now + timedelta(seconds=settings.MAIL_CLAIM_TIMEOUT))
+    return batch
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(settings.MAIL_RETRY_BACKOFF * 2 ** (attempts - 1), settings.MAIL_RETRY_BACKOFF_MAX))
+
+
+def _mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.MAIL_MAX_ATTEMPTS:
+        email.status = OutgoingEmail.FAILED
+    else:
+        email.next_attempt_at = timezone.now() + _backoff(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def dispatch_pending(batch_size=None):
+    """Send one batch of due messages over a single SMTP connection. Returns ``(sent, failed)``."""
+    batch = _claim_batch(batch_size or settings.MAIL_BATCH_SIZE)
+    if not batch:
+        return 0, 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as exc:
+        logger.warning('Could not connect to mail server: %s', exc)
+        for email in batch:
+            _mark_failed(email, exc)
+        return 0, len(batch)
+
+    sent = []
+    failed = 0
+    try:
+        for email in batch:
+            message = EmailMessage(email.subject, email.body, email.from_email, email.to, connection=connection)
+            try:
+                connection.send_messages([message])
+            except Exception as exc:
+                logger.warning('Sending outgoing email %s failed: %s', email.pk, exc)
+                _mark_failed(email, exc)
+                failed += 1
+            else:
+                sent.append(email.pk)
+    finally:
+        connection.close()
+
+    OutgoingEmail.objects.filter(pk__in=sent).update(status=OutgoingEmail.SENT, sent_at=timezone.now(), last_error='')
+    return len(sent), failed
@@ -0,0 +1,137 @@
+import json
+import time
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+from django.urls import reverse
+
+from User.bench import Timer, format_summary, summarize
+from User.models import User
+from User.views import get_tokens_for_user
+
+PASSWORD = 'bench-Password-1'
+SCENARIOS = ('signup', 'login', 'refresh', 'logout', 'list', 'list_cold')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the auth API in-process against a freshly created and seeded test database, '
+        'and compare the results with a stored JSON baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to seed')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--baseline', help='JSON file to compare against')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative regression in throughput and p95 before failing')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the test database between runs')
+
+    def handle(self, *args, **options):
+        scenarios = [s.strip() for s in options['scenarios'].split(',') if s.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        # The test database (an in-memory SQLite or a test_ MySQL schema) keeps the real data out of it, and
+        # verification mail from signups stays in the outbox table and django.core.mail.outbox.
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                               MAIL_DISPATCH_IN_PROCESS=False):
+            old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'],
+                                         aliases={'default'})
+            try:
+                self.seed(options['users'])
+                results = {name: self.run(name, options['requests']) for name in scenarios}
+            finally:
+                teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+
+        for name, summary in results.items():
+            self.stdout.write(f"{format_summary(name, summary)}  {summary['queries_per_request']:.1f} queries/req")
+
+        if options['save_baseline']:
+            Path(options['save_baseline']).write_text(json.dumps(results, indent=2, sort_keys=True))
+        if options['baseline']:
+            self.compare(results, json.loads(Path(options['baseline']).read_text()), options['threshold'])
+
+    def seed(self, count):
+        User.objects.all().delete()
+        encoded = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(email=f'bench{i}@example.com', username=f'bench{i}', first_name=f'First{i}',
+                 last_name=f'Last{i}', bio='Lorem ipsum dolor sit amet', password=encoded, is_active=True)
+            for i in range(count)
+        ], batch_size=1000)
+        self.user = User.objects.order_by('pk').first() or User.objects.create(
+            email='bench@example.com', username='bench', password=encoded, is_active=True)
+
+    def requests(self, name):
+        """Yield ``(method, path, kwargs)`` for each request of a scenario."""
+        tokens = get_tokens_for_user(self.user)
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {tokens['access']}"}
+        run = time.time_ns()
+        i = 0
+        while True:
+            i += 1
+            if name == 'signup':
+                email = f'signup{run}-{i}@example.com'
+                yield 'post', reverse('User:signup_endpoint'), {'data': {
+                    'email': email, 'first_name': 'Bench', 'last_name': 'User',
+                    'password': PASSWORD, 'password2': PASSWORD}, 'content_type': 'application/json'}
+            elif name == 'login':
+                yield 'post', reverse('User:login_endpoint'), {'data': {
+                    'email': self.user.email, 'password': PASSWORD}, 'content_type': 'application/json'}
+            elif name == 'refresh':
+                yield 'post', reverse('User:token_refresh_endpoint'), {
+                    'data': {'refresh': tokens['refresh']}, 'content_type': 'application/json'}
+            elif name == 'logout':
+                # Logging out revokes the access token, so each request needs a pair of its own.
+                pair = get_tokens_for_user(self.user)
+                yield 'post', reverse('User:logout_endpoint'), {
+                    'data': {'refresh': pair['refresh']}, 'content_type': 'application/json',
+                    'HTTP_AUTHORIZATION': f"Bearer {pair['access']}"}
+            elif name == 'list':
+                yield 'get', reverse('User:users_endpoint'), auth
+            elif name == 'list_cold':
+                # A distinct query string per request misses the list cache every time.
+                yield 'get', f"{reverse('User:users_endpoint')}?bench={run}-{i}", auth
+
+    def run(self, name, total):
+        client = Client()
+        latencies, queries, statuses = [], 0, set()
+        scenario = self.requests(name)
+        with Timer() as elapsed:
+            for _ in range(total):
+                method, path, kwargs = next(scenario)
+                with CaptureQueriesContext(connection) as captured, Timer() as timer:
+                    response = getattr(client, method)(path, **kwargs)
+                latencies.append(timer.elapsed)
+                queries += len(captured)
+                statuses.add(response.status_code)
+        if any(code >= 400 for code in statuses):
+            self.stderr.write(f'{name}: responses with status {sorted(statuses)}')
+        summary = summarize(latencies, elapsed.elapsed)
+        summary['queries_per_request'] = queries / total if total else 0.0
+        return summary
+
+    def compare(self, results, baseline, threshold):
+        regressions = []
+        for name, summary in results.items():
+            base = baseline.get(name)
+            if not base:
+                continue
+            if summary['rps'] < base['rps'] * (1 - threshold):
+                regressions.append(f"{name}: {summary['rps']:.1f} req/s vs baseline {base['rps']:.1f}")
+            if summary['p95_ms'] > base['p95_ms'] * (1 + threshold):
+                regressions.append(f"{name}: p95 {summary['p95_ms']:.2f} ms vs baseline {base['p95_ms']:.2f}")
+            if summary['queries_per_request'] > base['queries_per_request'] + 0.01:
+                regressions.append(f"{name}: {summary['queries_per_request']:.1f} queries/req "
+                                   f"vs baseline {base['queries_per_request']:.1f}")
+        if regressions:
+            raise CommandError('Regressions against baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write('No regressions against baseline')
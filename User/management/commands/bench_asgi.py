@@ -0,0 +1,85 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from User.bench import Timer, format_summary, summarize
+from User.models import User
+from User.views import get_tokens_for_user
+
+ENDPOINTS = {
+    'users': ('User:users_endpoint', 'User:async_users_endpoint'),
+    'logout': ('User:logout_endpoint', 'User:async_logout_endpoint'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/sec and latency of the WSGI (APIView) and ASGI (async view) auth endpoints in-process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', choices=ENDPOINTS, default='users')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--email', help='User to authenticate as (defaults to the first active user)')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True)
+        if options['email']:
+            users = users.filter(email=options['email'])
+        user = users.first()
+        if user is None:
+            raise CommandError('No active user to authenticate as')
+
+        wsgi_name, asgi_name = ENDPOINTS[options['endpoint']]
+        method = 'get' if options['endpoint'] == 'users' else 'post'
+        total, concurrency = options['requests'], options['concurrency']
+
+        wsgi = self.run_wsgi(reverse(wsgi_name), method, self.requests(user, method, total), concurrency)
+        asgi = asyncio.run(
+            self.run_asgi(reverse(asgi_name), method, self.requests(user, method, total), concurrency))
+
+        self.stdout.write(format_summary(f'wsgi {wsgi_name}', wsgi))
+        self.stdout.write(format_summary(f'asgi {asgi_name}', asgi))
+
+    def requests(self, user, method, total):
+        """Request kwargs for each of ``total`` requests, minted before the clock starts."""
+        if method == 'get':
+            return [{'HTTP_AUTHORIZATION': f"Bearer {get_tokens_for_user(user)['access']}"}] * total
+        # Logging out revokes the access token, so each request needs a pair of its own.
+        pairs = (get_tokens_for_user(user) for _ in range(total))
+        return [{'data': {'refresh': pair['refresh']}, 'content_type': 'application/json',
+                 'HTTP_AUTHORIZATION': f"Bearer {pair['access']}"} for pair in pairs]
+
+    def run_wsgi(self, path, method, requests, concurrency):
+        def worker(share):
+            client = Client()
+            latencies = []
+            for kwargs in share:
+                with Timer() as timer:
+                    getattr(client, method)(path, **kwargs)
+                latencies.append(timer.elapsed)
+            connections.close_all()
+            return latencies
+
+        shares = [requests[i::concurrency] for i in range(concurrency)]
+        with Timer() as timer, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(worker, shares))
+        return summarize([latency for result in results for latency in result], timer.elapsed)
+
+    async def run_asgi(self, path, method, requests, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(kwargs):
+            async with semaphore:
+                with Timer() as timer:
+                    await getattr(client, method)(path, **kwargs)
+                latencies.append(timer.elapsed)
+
+        with Timer() as timer:
+            await asyncio.gather(*(one(kwargs) for kwargs in requests))
+        return summarize(latencies, timer.elapsed)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from User.bench import Timer
+from User.models import User
+from User.serializer import UserListSerializer, UserRowSerializer
+
+FIELDS = ('last_name', 'first_name', 'email', 'username', 'bio', 'profile_photo_url')
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of the DRF UserListSerializer and the compiled UserRowSerializer, JSON included'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma separated row counts')
+        parser.add_argument('--repeat', type=int, default=3, help='Best of N runs per size')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        serializer = UserRowSerializer(FIELDS)
+        for size in (int(s) for s in options['sizes'].split(',')):
+            users = [
+                User(id=i, first_name=f'First{i}', last_name=f'Last{i}', email=f'user{i}@example.com',
+                     username=f'user{i}', bio='Lorem ipsum dolor sit amet ' * 4, date_joined=now, last_login=now)
+                for i in range(size)
+            ]
+            rows = [tuple(getattr(user, column) if column != 'avatar' else user.avatar.name
+                          for column in serializer.columns) for user in users]
+
+            drf = min(self.time(lambda: JSONRenderer().render(UserListSerializer(users, many=True).data))
+                      for _ in range(options['repeat']))
+            compiled = min(self.time(lambda: serializer.dumps([serializer.to_representation(row) for row in rows]))
+                           for _ in range(options['repeat']))
+            self.stdout.write(f'{size:>8} rows  drf {size / drf:>12,.0f} rows/s  '
+                              f'compiled {size / compiled:>12,.0f} rows/s  ({drf / compiled:.1f}x)')
+
+    def time(self, func):
+        with Timer() as timer:
+            func()
+        return timer.elapsed
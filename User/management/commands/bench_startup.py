@@ -0,0 +1,79 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter per sample: set Django up through the WSGI entry point, then serve one request.
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+ready = time.perf_counter()
+from wsgiref.util import setup_testing_defaults
+environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1]}
+setup_testing_defaults(environ)
+statuses = []
+b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+done = time.perf_counter()
+print(ready - start, done - start, statuses[0].split()[0], len(sys.modules))
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure cold start per settings module: interpreter + Django setup + URLconf import, time to the first '
+        'response, modules loaded, and the slowest imports from python -X importtime'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settings-modules', default='Photo.settings,Photo.settings_api')
+        parser.add_argument('--path', default='/auth/api/users/',
+                            help='Path of the first request (an unauthenticated request needs no database)')
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15, help='Slowest imports to list per settings module')
+
+    def handle(self, *args, **options):
+        for module in [name.strip() for name in options['settings_modules'].split(',') if name.strip()]:
+            env = {**os.environ, 'DJANGO_SETTINGS_MODULE': module}
+            samples = [self.sample(env, options['path']) for _ in range(options['runs'])]
+            process, ready, first, modules = (statistics.median(column) for column in zip(*samples))
+            self.stdout.write(
+                f'{module}: process {process * 1000:.0f} ms, setup {ready * 1000:.0f} ms, '
+                f'first response {first * 1000:.0f} ms, {modules:.0f} modules (median of {len(samples)})')
+            for cumulative, name in self.importtime(env, options['path'])[:options['top']]:
+                self.stdout.write(f'    {cumulative / 1000:8.1f} ms  {name}')
+
+    def run_probe(self, env, path, *flags):
+        return subprocess.run([sys.executable, *flags, '-c', PROBE, path], cwd=settings.BASE_DIR, env=env,
+                              capture_output=True, text=True)
+
+    def sample(self, env, path):
+        start = time.perf_counter()
+        result = self.run_probe(env, path)
+        elapsed = time.perf_counter() - start
+        if result.returncode:
+            raise CommandError(result.stderr.strip())
+        ready, first, status, modules = result.stdout.split()
+        if status.startswith('5'):
+            raise CommandError(f'First request to {path} answered {status}')
+        return elapsed, float(ready), float(first), int(modules)
+
+    def importtime(self, env, path):
+        """``(cumulative microseconds, top-level module)`` pairs, slowest first."""
+        result = self.run_probe(env, path, '-X', 'importtime')
+        rows = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            # Nested imports are indented under the module that triggered them; keep the outermost ones.
+            if not name[1:].startswith(' '):
+                rows.append((int(cumulative), name.strip()))
+        return sorted(rows, reverse=True)
@@ -0,0 +1,82 @@
+import secrets
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.settings import api_settings
+
+from User.bench import Timer, format_summary, summarize
+from User.models import User
+from User.tokens import build_service
+
+ALGORITHMS = ('HS256', 'RS256', 'ES256', 'EdDSA')
+
+
+def generate_keys(algorithm):
+    """A throwaway (signing, verifying) PEM pair for ``algorithm``, or an HMAC secret."""
+    if algorithm.startswith('HS'):
+        return secrets.token_urlsafe(32), ''
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+    except ImportError:
+        raise CommandError(f'{algorithm} needs the cryptography package')
+    if algorithm.startswith('RS'):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm.startswith('ES'):
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_pem.decode(), public_pem.decode()
+
+
+class Command(BaseCommand):
+    help = 'Measure tokens/sec for each JWT algorithm, comparing User.tokens with the stock SimpleJWT backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--algorithms', default=','.join(ALGORITHMS))
+
+    def handle(self, *args, **options):
+        user = User(pk=1)
+        iterations = options['iterations']
+        for algorithm in [name.strip() for name in options['algorithms'].split(',') if name.strip()]:
+            signing_key, verifying_key = generate_keys(algorithm)
+            service = build_service(algorithm, signing_key, verifying_key)
+            access = service.tokens_for_user(user, refresh=False)['access']
+            cases = {
+                'service pair': lambda: service.tokens_for_user(user),
+                'service access-only': lambda: service.tokens_for_user(user, refresh=False),
+                'service decode': lambda: service.decode(access),
+            }
+            try:
+                backend = TokenBackend(algorithm, signing_key, verifying_key or None)
+            except Exception as exc:
+                self.stderr.write(f'{algorithm}: stock backend unavailable ({exc})')
+            else:
+                cases['simplejwt encode'] = lambda: backend.encode(self.payload())
+                cases['simplejwt decode'] = lambda: backend.decode(access)
+
+            for name, case in cases.items():
+                latencies = []
+                with Timer() as elapsed:
+                    for _ in range(iterations):
+                        with Timer() as timer:
+                            case()
+                        latencies.append(timer.elapsed)
+                self.stdout.write(format_summary(f'{algorithm} {name}', summarize(latencies, elapsed.elapsed)))
+
+    def payload(self):
+        now = int(time.time())
+        return {
+            api_settings.TOKEN_TYPE_CLAIM: 'access',
+            'exp': now + 300,
+            'iat': now,
+            api_settings.JTI_CLAIM: uuid.uuid4().hex,
+            api_settings.USER_ID_CLAIM: 1,
+        }
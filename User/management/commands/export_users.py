@@ -0,0 +1,53 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from User.models import User
+
+EXPORT_FIELDS = (
+    'id', 'email', 'username', 'first_name', 'last_name', 'bio', 'avatar',
+    'date_joined', 'last_login', 'is_active', 'is_staff', 'is_admin', 'is_superuser', 'password',
+)
+DEFAULT_EXPORT_FIELDS = ('email', 'username', 'first_name', 'last_name', 'bio', 'is_active', 'date_joined')
+
+
+class Command(BaseCommand):
+    help = 'Stream users to CSV or NDJSON without loading the table into memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, or '-' for stdout")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--fields', default=','.join(DEFAULT_EXPORT_FIELDS),
+                            help='Comma separated: ' + ', '.join(EXPORT_FIELDS))
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        fields = [f.strip() for f in options['fields'].split(',') if f.strip()]
+        unknown = set(fields) - set(EXPORT_FIELDS)
+        if unknown or not fields:
+            raise CommandError(f"Unknown fields: {', '.join(sorted(unknown))}" if unknown else 'No fields given')
+
+        rows = User.objects.order_by('pk').values_list(*fields).iterator(chunk_size=options['chunk_size'])
+        stream = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        exported = 0
+        try:
+            if fmt == 'csv':
+                writer = csv.writer(stream)
+                writer.writerow(fields)
+                for row in rows:
+                    writer.writerow(row)
+                    exported += 1
+            else:
+                encoder = DjangoJSONEncoder()
+                for row in rows:
+                    stream.write(encoder.encode(dict(zip(fields, row))) + '\n')
+                    exported += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        self.stderr.write(f'Exported {exported} users')
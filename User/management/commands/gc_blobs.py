@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from User.blobs import collect_batch
+
+
+class Command(BaseCommand):
+    help = 'Delete stored blobs (and their renditions) that nothing has referenced for the grace period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--grace-seconds', type=int, default=3600,
+                            help='How long a blob must stay unreferenced; covers uploads not yet attached')
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        grace = timedelta(seconds=options['grace_seconds'])
+        removed = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            # One transaction per batch, so row locks and file deletions stay bounded.
+            count = collect_batch(grace, options['batch_size'])
+            removed += count
+            batches += 1
+            if count < options['batch_size']:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f'Deleted {removed} unreferenced blobs')
@@ -0,0 +1,168 @@
+import csv
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.core.exceptions import ValidationError
+from django.db import DataError, IntegrityError, transaction
+
+from User.listcache import bump_version
+from User.models import User
+
+
+class _InvalidRow(Exception):
+    pass
+
+
+def read_rows(stream, fmt):
+    """Yield each record as a dict, or as an _InvalidRow for a record that could not be parsed."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield _InvalidRow(f'invalid JSON ({exc})')
+                continue
+            yield row if isinstance(row, dict) else _InvalidRow('not a JSON object')
+
+
+def as_bool(value, default):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+class Command(BaseCommand):
+    help = 'Import users from CSV or NDJSON, hashing passwords in parallel and inserting with bulk_create'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None, help='Password hashing processes (default: CPUs)')
+        parser.add_argument('--hashed', action='store_true', help='The password column already holds Django hashes')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+
+        self.created = self.conflicts = 0
+        self.batch_size = options['batch_size']
+        self.workers = options['workers'] or os.cpu_count() or 1
+        pool = None if options['hashed'] else ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            rows = read_rows(stream, fmt)
+            line = 1
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch, line, pool)
+                line += len(batch)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if stream is not sys.stdin:
+                stream.close()
+
+        if self.created:
+            bump_version()
+        self.stdout.write(f'Created {self.created} users, {self.conflicts} conflicts')
+
+    def conflict(self, line, row, reason):
+        self.conflicts += 1
+        self.stderr.write(f"record {line}: {row.get('email')!r} skipped: {reason}")
+
+    def build(self, row):
+        email = User.objects.normalize_email(str(row.get('email') or '').strip())
+        if not email:
+            raise _InvalidRow('missing email')
+        user = User(
+            email=email,
+            username=str(row.get('username') or email.split('@')[0]).strip(),
+            first_name=row.get('first_name') or '',
+            last_name=row.get('last_name') or '',
+            bio=row.get('bio') or '',
+            password=row.get('password') or '',
+            is_active=as_bool(row.get('is_active'), True),
+            is_staff=as_bool(row.get('is_staff'), False),
+            is_admin=as_bool(row.get('is_admin'), False),
+            is_superuser=as_bool(row.get('is_superuser'), False),
+        )
+        # Lengths, types and formats, so one bad row is reported here instead of failing the batch's INSERT.
+        # The password is hashed (or set unusable) later, and names have always been optional in imports.
+        exclude = ['password'] + [field for field in ('first_name', 'last_name') if not getattr(user, field)]
+        try:
+            user.clean_fields(exclude=exclude)
+        except ValidationError as exc:
+            raise _InvalidRow('; '.join(f"{field}: {' '.join(messages)}"
+                                        for field, messages in exc.message_dict.items()))
+        return user
+
+    def import_batch(self, batch, first_line, pool):
+        users = []
+        seen_emails, seen_usernames = set(), set()
+        for line, row in enumerate(batch, first_line):
+            if isinstance(row, _InvalidRow):
+                self.conflict(line, {}, row)
+                continue
+            try:
+                user = self.build(row)
+            except _InvalidRow as exc:
+                self.conflict(line, row, exc)
+                continue
+            if user.email in seen_emails or user.username in seen_usernames:
+                self.conflict(line, row, 'duplicate in input')
+                continue
+            seen_emails.add(user.email)
+            seen_usernames.add(user.username)
+            users.append((line, row, user))
+
+        taken_emails = set(User.objects.filter(email__in=seen_emails).values_list('email', flat=True))
+        taken_usernames = set(User.objects.filter(username__in=seen_usernames).values_list('username', flat=True))
+        fresh = []
+        for line, row, user in users:
+            if user.email in taken_emails:
+                self.conflict(line, row, 'email already exists')
+            elif user.username in taken_usernames:
+                self.conflict(line, row, 'username already exists')
+            else:
+                fresh.append((line, row, user))
+
+        if pool is not None:
+            passwords = [user.password or None for _, _, user in fresh]
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            for (_, _, user), encoded in zip(fresh, pool.map(make_password, passwords, chunksize=chunksize)):
+                user.password = encoded
+        else:
+            for _, _, user in fresh:
+                user.password = user.password or make_password(None)
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create([user for _, _, user in fresh], batch_size=self.batch_size)
+            self.created += len(fresh)
+        except (DataError, IntegrityError):
+            # Someone else inserted a clashing row since we checked, or the database rejected a value the
+            # field checks let through: fall back to per-row savepoints to find the row.
+            for line, row, user in fresh:
+                try:
+                    with transaction.atomic():
+                        user.save(force_insert=True)
+                    self.created += 1
+                except (DataError, IntegrityError) as exc:
+                    user.pk = None
+                    self.conflict(line, row, exc)
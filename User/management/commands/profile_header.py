@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from User.profiling import profile_header
+
+
+class Command(BaseCommand):
+    help = 'Print an X-Profile header value that profiles requests to one URL name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url_name', help='e.g. users_endpoint or login_endpoint')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"X-Profile: {profile_header(options['url_name'])}")
+        self.stderr.write(f'Valid for {settings.PROFILING_HEADER_MAX_AGE} seconds on processes with PROFILING_ENABLED')
@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from User.models import AvatarUpload
+from User.uploads import discard
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable avatar uploads that have not received data recently, with their part files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=24, help='Hours since the last chunk')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['older_than'])
+        purged = 0
+        for upload in AvatarUpload.objects.filter(updated_at__lt=cutoff).iterator():
+            discard(upload)
+            upload.delete()
+            purged += 1
+        self.stdout.write(f'Purged {purged} stale uploads')
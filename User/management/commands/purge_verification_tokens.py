@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from User.models import EmailVerificationToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired email verification tokens in bounded batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.0, help='Seconds to pause between batches')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = EmailVerificationToken.objects.filter(expires_at__lte=now).order_by('expires_at')
+        deleted = 0
+        while True:
+            # Delete by primary key so each statement locks at most one batch of rows.
+            batch = list(expired.values_list('pk', flat=True)[:options['batch_size']])
+            if not batch:
+                break
+            deleted += EmailVerificationToken.objects.filter(pk__in=batch).delete()[0]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f'Deleted {deleted} expired tokens')
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from User.mailer import dispatch_pending
+
+
+class Command(BaseCommand):
+    help = 'Send queued outgoing emails in batches over a single mail server connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Keep draining the outbox until interrupted')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = dispatch_pending(options['batch_size'])
+            while sent or failed:
+                self.stdout.write(f'Sent {sent}, failed {failed}')
+                sent, failed = dispatch_pending(options['batch_size'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -1,8 +1,10 @@
 from django.contrib.auth.base_user import BaseUserManager
 
+from . import hashing
+
 
 class MyUserManager(BaseUserManager):
-    def create_user(self, first_name, last_name, email,  password=None):
+    def create_user(self, first_name, last_name, email,  password=None, **extra_fields):
         if not email:
             raise ValueError('User must have an email address')
 
@@ -11,9 +13,9 @@ class MyUserManager(BaseUserManager):
             email=self.normalize_email(email),
             first_name=first_name,
             last_name=last_name,
-
+            **extra_fields
         )
-        user.set_password(password)
+        user.password = hashing.make_password(password)
         user.save(using=self._db)
         return user
 
@@ -0,0 +1,133 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from .storage import BLOB_PREFIX
+from .uploads import CHUNK_SIZE
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Names derived from the file's digest (and, for renditions, the encoder options) never change content, so clients
+# and CDNs may keep them for good.
+IMMUTABLE_PREFIXES = (BLOB_PREFIX + '/', f'renditions/{BLOB_PREFIX}/')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _resolve(path):
+    # Dotfiles and dot-directories are private.
+    if any(part.startswith('.') for part in posixpath.normpath(path).split('/')):
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except ValueError:
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    return full_path, stat
+
+
+def _parse_range(header, size):
+    """``(start, end)`` inclusive for a single satisfiable byte range, None to send everything, or False."""
+    match = RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            return False
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _read_range(f, length):
+    with f:
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file under MEDIA_ROOT. With MEDIA_SENDFILE set, only the headers are produced here and the front server
+    sends the body (X-Accel-Redirect for nginx, X-Sendfile for Apache/lighttpd). Otherwise the file goes out through
+    FileResponse, which the WSGI server can send with sendfile(), with single-range requests supported.
+    """
+    full_path, stat = _resolve(path)
+    immutable = path.startswith(IMMUTABLE_PREFIXES)
+    last_modified = int(stat.st_mtime)
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    # 304 or 412 from the conditional headers (lists, weak tags and If-Modified-Since as RFC 9110 has them).
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, path, full_path, stat.st_size)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    if response.status_code in (200, 206):
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Last-Modified'] = http_date(last_modified)
+    response['ETag'] = etag
+    response['Cache-Control'] = (IMMUTABLE_CACHE_CONTROL if immutable
+                                 else f'public, max-age={settings.MEDIA_CACHE_MAX_AGE}')
+    return response
+
+
+def _file_response(request, path, full_path, size):
+    backend = settings.MEDIA_SENDFILE
+    if backend == 'nginx':
+        # The front server does Range and reads the file; the internal location maps the prefix to MEDIA_ROOT.
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.MEDIA_SENDFILE_PREFIX + quote(path)
+        return response
+    if backend in ('apache', 'lighttpd'):
+        response = HttpResponse()
+        response['X-Sendfile'] = full_path
+        return response
+
+    byte_range = _parse_range(request.META['HTTP_RANGE'], size) if 'HTTP_RANGE' in request.META else None
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    f = open(full_path, 'rb')
+    if byte_range is None or request.method == 'HEAD':
+        response = FileResponse(f)
+        response['Content-Length'] = str(size)
+    elif byte_range[1] == size - 1:
+        # Open-ended ranges (resumed downloads) keep the zero-copy path: the file is sent from its position.
+        start = byte_range[0]
+        f.seek(start)
+        response = FileResponse(f, status=206)
+        response['Content-Length'] = str(size - start)
+        response['Content-Range'] = f'bytes {start}-{size - 1}/{size}'
+    else:
+        start, end = byte_range
+        f.seek(start)
+        response = StreamingHttpResponse(_read_range(f, end - start + 1), status=206)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
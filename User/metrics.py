@@ -0,0 +1,159 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+def log_linear_bounds(lowest, highest, sub_buckets):
+    """HDR-style bucket bounds: every power of two between ``lowest`` and ``highest`` split linearly."""
+    bounds = []
+    start = lowest
+    while start < highest:
+        step = start / sub_buckets
+        bounds.extend(start + step * i for i in range(sub_buckets))
+        start *= 2
+    bounds.append(highest)
+    return bounds
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+# 0.1 ms .. ~105 s with 4 buckets per doubling.
+SECONDS_BOUNDS = log_linear_bounds(0.0001, 104.8576, 4)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def histogram(self, name, labels, bounds=SECONDS_BOUNDS):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(bounds))
+        return histogram
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def render(self, extra=()):
+        """
+        The registry, plus ``(name, labels, value, kind)`` samples from ``extra`` (kind 'counter' or 'gauge'), in
+        Prometheus text format.
+        """
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} {kind}')
+
+        # Snapshot under the lock: histogram() may add an entry from another thread while we iterate.
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        for (name, labels), histogram in histograms:
+            header(name, 'histogram')
+            counts, total, count = histogram.snapshot()
+            cumulative = 0
+            for bound, bucket in zip(histogram.bounds + [float('inf')], counts):
+                cumulative += bucket
+                le = '+Inf' if bound == float('inf') else f'{bound:.6g}'
+                lines.append(f'{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {total}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+        with self._lock:
+            counters = sorted(self.counters.items())
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{_labels(labels)} {value}')
+        for name, labels, value, kind in extra:
+            header(name, kind)
+            lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+registry = Registry()
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = []
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.db_seconds += duration
+            self.queries.append((sql, duration))
+
+
+current_request = ContextVar('current_request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper on every connection: times the query for the tracked request, if there is one."""
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    ``connection_created`` receiver. One permanent wrapper that follows the current_request context variable works
+    for sync and async requests alike, where a per-request execute_wrapper would have to be installed on the
+    connection of whichever thread ends up running the queries.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializer_timer():
+    """Attribute the time spent in the block to serialization for the current request, if one is tracked."""
+    stats = current_request.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_seconds += time.perf_counter() - start
@@ -0,0 +1,199 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import profiling, routers
+from .metrics import RequestStats, current_request, registry
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_pin'
+
+
+class HybridMiddleware:
+    """
+    Base for middleware that runs natively in both handler modes: ``__call__`` under WSGI and, once
+    ``get_response`` is a coroutine (ASGI), ``__acall__``, so Django never has to run the chain in a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+
+class ReplicaPinningMiddleware(HybridMiddleware):
+    """Scope read-your-writes pinning to the request and carry it to the client's next requests in a cookie."""
+
+    def handle(self, request):
+        token = routers.pin_to_primary(PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+            wrote = routers.is_pinned() and PIN_COOKIE not in request.COOKIES
+        finally:
+            routers.unpin(token)
+        return self.finish(response, wrote)
+
+    async def __acall__(self, request):
+        # Writes made in sync_to_async threads set the pin in a copy of this context; asgiref copies it back.
+        token = routers.pin_to_primary(PIN_COOKIE in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+            wrote = routers.is_pinned() and PIN_COOKIE not in request.COOKIES
+        finally:
+            routers.unpin(token)
+        return self.finish(response, wrote)
+
+    def finish(self, response, wrote):
+        if wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.DATABASE_REPLICA_PIN_SECONDS, httponly=True,
+                                samesite='Lax')
+        return response
+
+
+class InstrumentationMiddleware(HybridMiddleware):
+    """
+    Record wall time, DB queries and time, serializer time and response size per URL name into
+    :data:`User.metrics.registry`, and log requests that exceed their PERFORMANCE_BUDGETS entry. Queries reach
+    the request's stats through :func:`User.metrics.record_query`, in whichever thread they run.
+    """
+
+    def handle(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.record(request, response, stats, time.perf_counter() - start)
+
+    def record(self, request, response, stats, wall):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unresolved'
+        labels = (('view', view),)
+        size = 0 if response.streaming else len(response.content)
+        registry.histogram('photo_request_duration_seconds', labels).observe(wall)
+        registry.histogram('photo_request_db_seconds', labels).observe(stats.db_seconds)
+        registry.inc('photo_requests_total', labels + (('status', response.status_code),))
+        registry.inc('photo_request_db_queries_total', labels, len(stats.queries))
+        registry.inc('photo_request_serializer_seconds_total', labels, stats.serializer_seconds)
+        registry.inc('photo_response_bytes_total', labels, size)
+
+        budget = settings.PERFORMANCE_BUDGETS.get(view, settings.PERFORMANCE_BUDGETS.get('*'))
+        if budget:
+            self.check_budget(request, view, budget, wall, stats)
+        return response
+
+    def check_budget(self, request, view, budget, wall, stats):
+        problems = []
+        if 'wall_ms' in budget and wall * 1000 > budget['wall_ms']:
+            problems.append(f"wall time {wall * 1000:.1f} ms > {budget['wall_ms']} ms")
+        if 'queries' in budget and len(stats.queries) > budget['queries']:
+            problems.append(f"{len(stats.queries)} queries > {budget['queries']}")
+        if 'db_ms' in budget and stats.db_seconds * 1000 > budget['db_ms']:
+            problems.append(f"db time {stats.db_seconds * 1000:.1f} ms > {budget['db_ms']} ms")
+        if not problems:
+            return
+
+        registry.inc('photo_budget_violations_total', (('view', view),))
+        repeated = [(sql, n) for sql, n in Counter(sql for sql, _ in stats.queries).most_common(3) if n > 1]
+        slowest = sorted(stats.queries, key=lambda query: query[1], reverse=True)[:3]
+        logger.warning(
+            'Budget exceeded for %s %s (%s): %s. Repeated queries (possible N+1): %s. Slowest queries: %s',
+            request.method, request.path, view, '; '.join(problems),
+            [f'{n}x {sql}' for sql, n in repeated] or 'none',
+            [f'{duration * 1000:.1f} ms {sql}' for sql, duration in slowest] or 'none',
+        )
+
+
+class ProfilingMiddleware(HybridMiddleware):
+    """
+    Profile the view of selected requests with :class:`User.profiling.Sampler` and keep the result in
+    :data:`User.profiling.store`. Listed last in MIDDLEWARE so that the samples cover the view and its rendering.
+    Async views (api/async/*) are never profiled: they run on the event loop's thread, interleaved with other
+    requests, not on the thread this middleware samples. Under ASGI, Django runs process_view in the same
+    thread as the sync view it precedes, so those are sampled as under WSGI.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            # Dropped from the chain: requests pay nothing when profiling is off.
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.slots = threading.BoundedSemaphore(settings.PROFILING_MAX_CONCURRENT)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = request.resolver_match.url_name
+        if not view or iscoroutinefunction(view_func):
+            return None
+        header = request.META.get('HTTP_X_PROFILE')
+        if header is not None:
+            wanted = profiling.header_allows(header, view)
+        else:
+            wanted = ((not settings.PROFILING_VIEWS or view in settings.PROFILING_VIEWS)
+                      and random.random() < settings.PROFILING_SAMPLE_RATE)
+        if wanted and self.slots.acquire(blocking=False):
+            request._profiler = profiling.Sampler(settings.PROFILING_INTERVAL, settings.PROFILING_MAX_SECONDS)
+            request._profiler.start()
+        return None
+
+    def handle(self, request):
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler = self.stop(request)
+        if sampler is not None:
+            self.save(request, response, sampler)
+        return response
+
+    async def __acall__(self, request):
+        try:
+            response = await self.get_response(request)
+        finally:
+            # Joining the sampler thread and writing the profile block, so keep them off the event loop.
+            sampler = await sync_to_async(self.stop)(request) if '_profiler' in request.__dict__ else None
+        if sampler is not None:
+            await sync_to_async(self.save)(request, response, sampler)
+        return response
+
+    def stop(self, request):
+        sampler = request.__dict__.pop('_profiler', None)
+        if sampler is not None:
+            sampler.stop()
+            self.slots.release()
+        return sampler
+
+    def save(self, request, response, sampler):
+        view = request.resolver_match.url_name
+        try:
+            name = profiling.store.save(view, sampler.speedscope(f'{request.method} {request.path} ({view})'))
+        except OSError:
+            logger.exception('Saving the profile of %s failed', request.path)
+        else:
+            response['X-Profile-Name'] = name
@@ -1,8 +1,18 @@
+import hashlib
+import secrets
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.validators import FileExtensionValidator
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser
+from . import hashing
 from .manager import MyUserManager
+from .storage import blob_storage
+from .uploads import AVATAR_EXTENSIONS
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 
 # Create your models here.
@@ -12,15 +22,19 @@ class User(AbstractBaseUser):
     last_name = models.CharField(max_length=50)
     email = models.EmailField(max_length=50, unique=True)
     bio = models.TextField(blank=True, null=True)
-    avatar = models.ImageField(blank=True, upload_to='avatar/% Y/%m/%d',
+    # Stored content-addressed: identical images share one file (see User.storage).
+    avatar = models.ImageField(blank=True, upload_to='avatar/% Y/%m/%d', storage=blob_storage,
                                validators=[
                                    FileExtensionValidator(
-                                       allowed_extensions=['jpeg ', 'png', 'jpg', 'webm'])]
+                                       allowed_extensions=AVATAR_EXTENSIONS)]
                                )
+    # Resized copies of ``avatar`` written by User.imaging, keyed by size then format.
+    avatar_renditions = models.JSONField(default=dict, blank=True)
     username = models.CharField(max_length=20, unique=True)
     # required Fields
     date_joined = models.DateTimeField(verbose_name='date joined', auto_now_add=True)
-    last_login = models.DateTimeField(verbose_name='last login', auto_now=True)
+    # Set on login only (see User.activity), not rewritten by every save.
+    last_login = models.DateTimeField(verbose_name='last login', blank=True, null=True)
     is_admin = models.BooleanField(default=False)
     is_active = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
@@ -29,18 +43,46 @@ class User(AbstractBaseUser):
     def clean(self):
         if self.avatar:
             # Check the image width and height here if needed
-            max_size = 1 * 1024 * 1024 * 1024
+            max_size = settings.AVATAR_MAX_UPLOAD_SIZE
             if self.avatar.size > max_size:
-                raise ValidationError("Image file too large ( > 1GB )")
+                raise ValidationError(f"Image file too large ( > {max_size} bytes )")
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['last_name', 'first_name', 'username']
 
     objects = MyUserManager()
 
+    class Meta:
+        # Typeahead prefix scans on either name order (User.search); email and username have unique indexes.
+        indexes = [
+            models.Index(fields=['last_name', 'first_name'], name='user_last_first_name_idx'),
+            models.Index(fields=['first_name', 'last_name'], name='user_first_last_name_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
+    # The hashing itself runs on User.hashing's pool; ModelBackend, the auth signals and the upgrade of stale
+    # hashes work as they do for AbstractBaseUser.
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        valid, must_update = hashing.verify_password(raw_password, self.password)
+        if must_update:
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return valid
+
+    async def acheck_password(self, raw_password):
+        valid, must_update = await hashing.averify_password(raw_password, self.password)
+        if must_update:
+            self.password = await hashing.amake_password(raw_password)
+            await self.asave(update_fields=['password'])
+        return valid
+
     def has_perm(self, perm, obj=None):
         return self.is_superuser
 
@@ -48,10 +90,119 @@ class User(AbstractBaseUser):
         return True
 
 
+class UserAgent(models.Model):
+    """Each distinct user agent string is stored once and referenced by id."""
+    value = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.value
+
+
 class UserAgentInfo(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    user_agent = models.CharField(max_length=255)
+    user_agent = models.ForeignKey(UserAgent, on_delete=models.PROTECT)
+    # Set from the sighting time by User.useragents, which writes these rows in batches after the fact.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.user_agent}"
+
+class OutgoingEmail(models.Model):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
+
+
+class AvatarUpload(models.Model):
+    """A resumable avatar upload; bytes are appended to a part file until ``received`` reaches ``size``."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.email} - {self.filename} ({self.received}/{self.size})"
+
+
+class EmailVerificationToken(models.Model):
+    """Only the SHA-256 of the emailed token is stored, so lookups are an exact match on a unique index."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    token_hash = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def hash_token(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def _new(cls, user):
+        token = secrets.token_urlsafe(32)
+        expires_at = timezone.now() + timedelta(hours=settings.EMAIL_VERIFICATION_TOKEN_TTL_HOURS)
+        return token, cls(user=user, token_hash=cls.hash_token(token), expires_at=expires_at)
+
+    @classmethod
+    def issue(cls, user):
+        token, instance = cls._new(user)
+        instance.save()
+        return token
+
+    @classmethod
+    async def aissue(cls, user):
+        token, instance = cls._new(user)
+        await instance.asave()
+        return token
+
+    def __str__(self):
+        return f"{self.user.email} (expires {self.expires_at})"
+
+
+class RevokedToken(models.Model):
+    """A logged-out JWT, kept only until the token would have expired anyway (see User.denylist)."""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.jti} (expires {self.expires_at})"
+
+
+class Blob(models.Model):
+    """
+    A file in the content-addressed storage, shared by every field holding the same bytes. ``refcount`` counts
+    those fields; a blob left at zero for longer than the grace period is deleted by ``manage.py gc_blobs``.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    # Rendered copies of an image blob, in the same shape as User.avatar_renditions.
+    renditions = models.JSONField(default=dict, blank=True)
+    unreferenced_at = models.DateTimeField(default=timezone.now, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.user.email} - {self.user_agent}"
\ No newline at end of file
+        return f"{self.name} ({self.refcount} references)"
@@ -0,0 +1,155 @@
+import base64
+from collections import namedtuple
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .metrics import serializer_timer
+
+LIST_FIELDS = (
+    'id', 'last_name', 'first_name', 'email', 'username', 'bio',
+    'avatar', 'profile_photo_url', 'date_joined', 'last_login', 'is_active', 'is_admin',
+)
+DEFAULT_LIST_FIELDS = ('last_name', 'first_name', 'email', 'username', 'bio')
+CURSOR_FIELDS = ('date_joined', 'id')
+
+Page = namedtuple('Page', ['results', 'next_cursor'])
+
+
+def parse_fields(value):
+    if not value:
+        return DEFAULT_LIST_FIELDS
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in LIST_FIELDS]
+    if unknown or not fields:
+        raise ValidationError({'fields': f"Unknown fields: {', '.join(unknown)}" if unknown else 'No fields given'})
+    return fields
+
+
+def parse_page_size(value, default=None):
+    if value in (None, ''):
+        return default or settings.USER_LIST_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except ValueError:
+        raise ValidationError({'page_size': 'Must be an integer'})
+    if page_size < 1:
+        raise ValidationError({'page_size': 'Must be positive'})
+    return min(page_size, settings.USER_LIST_MAX_PAGE_SIZE)
+
+
+def encode_cursor(date_joined, pk):
+    raw = f"{date_joined.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date_joined, pk = raw.rsplit('|', 1)
+        date_joined, pk = parse_datetime(date_joined), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    if date_joined is None:
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return date_joined, pk
+
+
+def keyset(queryset, cursor=None):
+    """Order by (date_joined, id) and seek past ``cursor`` without an OFFSET."""
+    queryset = queryset.order_by(*CURSOR_FIELDS)
+    if cursor:
+        date_joined, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date_joined__gt=date_joined) | Q(date_joined=date_joined, id__gt=pk))
+    return queryset
+
+
+def _page(rows, serializer, page_size):
+    next_cursor = encode_cursor(*serializer.cursor(rows[page_size - 1])) if len(rows) > page_size else None
+    rows = rows[:page_size]
+    with serializer_timer():
+        results = [serializer.to_representation(row) for row in rows]
+    return Page(results, next_cursor)
+
+
+def fetch_page(queryset, serializer, page_size):
+    """``queryset`` comes from ``serializer.project``; rows are the tuples it selects."""
+    return _page(list(queryset[:page_size + 1]), serializer, page_size)
+
+
+def next_page_headers(request, next_cursor):
+    if not next_cursor:
+        return {}
+    query = request.GET.copy()
+    query['cursor'] = next_cursor
+    return {
+        'X-Next-Cursor': next_cursor,
+        'Link': f'<{request.build_absolute_uri(request.path)}?{query.urlencode()}>; rel="next"',
+    }
+
+
+# (opening, separator, closing, line end, content type)
+STREAM_FORMATS = {
+    'ndjson': (b'', b'', b'', b'\n', 'application/x-ndjson'),
+    'json': (b'[', b',', b']', b'', 'application/json'),
+}
+
+
+def _stream_format(stream_format):
+    if stream_format not in STREAM_FORMATS:
+        raise ValidationError({'stream': f"Must be one of: {', '.join(STREAM_FORMATS)}"})
+    return STREAM_FORMATS[stream_format]
+
+
+def _render(rows, serializer, stream_format):
+    opening, separator, closing, line_end, _ = STREAM_FORMATS[stream_format]
+    yield opening
+    sep = b''
+    for row in rows:
+        yield sep + serializer.dumps(serializer.to_representation(row)) + line_end
+        sep = separator
+    yield closing
+
+
+async def _arender(rows, serializer, stream_format):
+    opening, separator, closing, line_end, _ = STREAM_FORMATS[stream_format]
+    yield opening
+    sep = b''
+    async for row in rows:
+        yield sep + serializer.dumps(serializer.to_representation(row)) + line_end
+        sep = separator
+    yield closing
+
+
+def stream_response(queryset, serializer, stream_format):
+    content_type = _stream_format(stream_format)[-1]
+    rows = queryset.iterator(chunk_size=settings.USER_LIST_STREAM_CHUNK_SIZE)
+    return StreamingHttpResponse(_render(rows, serializer, stream_format), content_type=content_type)
+
+
+async def afetch_page(queryset, serializer, page_size):
+    return _page([row async for row in queryset[:page_size + 1]], serializer, page_size)
+
+
+async def _aiterate(queryset, chunk_size):
+    # QuerySet.aiterator() runs a values_list() query on the event loop, so fetch chunk by chunk in a thread.
+    rows = queryset.iterator(chunk_size=chunk_size)
+    next_chunk = sync_to_async(lambda: list(islice(rows, chunk_size)))
+    while True:
+        chunk = await next_chunk()
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            break
+
+
+def astream_response(queryset, serializer, stream_format):
+    content_type = _stream_format(stream_format)[-1]
+    rows = _aiterate(queryset, settings.USER_LIST_STREAM_CHUNK_SIZE)
+    return StreamingHttpResponse(_arender(rows, serializer, stream_format), content_type=content_type)
@@ -0,0 +1,158 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+
+PROFILE_NAME = re.compile(r'^\d+-[\w-]+\.json$')
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+signer = signing.TimestampSigner(salt='User.profiling')
+
+
+def profile_header(url_name):
+    """A value for the X-Profile header that profiles the next requests to ``url_name`` until it expires."""
+    return signer.sign(url_name)
+
+
+def header_allows(value, url_name):
+    try:
+        return signer.unsign(value, max_age=settings.PROFILING_HEADER_MAX_AGE) == url_name
+    except signing.BadSignature:
+        return False
+
+
+class Sampler:
+    """
+    Statistical profiler for one thread: a helper thread reads the target's stack from ``sys._current_frames()``
+    every ``interval`` seconds and counts identical stacks. The profiled code is not traced, so its cost does not
+    grow with the number of calls it makes; sampling stops after ``max_seconds``.
+    """
+
+    def __init__(self, interval, max_seconds):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self.started = self.stopped = None
+        self._target = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+
+    def _run(self):
+        deadline = self.started + self.max_seconds
+        while not self._done.wait(self.interval) and time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((getattr(code, 'co_qualname', code.co_name), code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            # Root first, as both output formats expect.
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def speedscope(self, name):
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in self.stacks.most_common():
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+            samples.append([index[frame] for frame in stack])
+            weights.append(count * self.interval)
+        return {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': name,
+            'exporter': 'User.profiling',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled', 'name': name, 'unit': 'seconds',
+                'startValue': 0, 'endValue': self.stopped - self.started,
+                'samples': samples, 'weights': weights,
+            }],
+        }
+
+
+def collapsed(profile):
+    """Brendan Gregg's collapsed-stack text (``a;b;c <samples>`` per line) from a stored speedscope profile."""
+    frames = profile['shared']['frames']
+    sampled = profile['profiles'][0]
+    interval = settings.PROFILING_INTERVAL
+    lines = []
+    for stack, weight in zip(sampled['samples'], sampled['weights']):
+        names = ';'.join(f"{frames[i]['name']} ({os.path.basename(frames[i]['file'])}:{frames[i]['line']})"
+                         for i in stack)
+        lines.append(f'{names} {round(weight / interval)}')
+    return '\n'.join(lines) + '\n'
+
+
+class ProfileStore:
+    """
+    Ring buffer of profiles in ``directory``: one speedscope JSON file per request, named so that they sort by
+    age, and the oldest deleted once there are more than ``max_profiles``.
+    """
+
+    def __init__(self, directory, max_profiles):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def save(self, url_name, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f'{time.time_ns()}-{url_name}.json'
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False) as f:
+            json.dump(profile, f, separators=(',', ':'))
+        os.replace(f.name, os.path.join(self.directory, name))
+        with self._lock:
+            for old in self.names()[self.max_profiles:]:
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except FileNotFoundError:
+                    pass
+        return name
+
+    def names(self):
+        """Stored profiles, newest first."""
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted((entry for entry in entries if PROFILE_NAME.match(entry)), reverse=True)
+
+    def list(self):
+        profiles = []
+        for name in self.names():
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            stamp, view = name[:-len('.json')].split('-', 1)
+            profiles.append({'name': name, 'view': view, 'created': int(stamp) / 1e9, 'size': size})
+        return profiles
+
+    def path(self, name):
+        """The file for ``name``, or None if it is not a stored profile."""
+        if not PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+store = ProfileStore(settings.PROFILING_DIR, settings.PROFILING_MAX_PROFILES)
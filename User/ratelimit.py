@@ -0,0 +1,171 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+# Sliding-window counters: the estimate for a key is the current fixed window's count plus the previous
+# window's count weighted by how much of it still overlaps the sliding window. Two integers per key,
+# no per-event log.
+
+
+def _estimate(previous, current, window, now):
+    elapsed = now % window
+    return previous * (window - elapsed) / window + current
+
+
+def _retry_after(previous, current, limit, window, now):
+    """Seconds until the estimate is back under ``limit``, as the hits weighing on it age out of the window."""
+    elapsed = now % window
+    if current < limit:
+        # The previous window's share alone keeps it at the limit and shrinks as it slides out.
+        wait = window - (limit - current) * window / previous - elapsed
+    else:
+        # Only once this window is the previous one and has slid far enough out.
+        wait = (window - elapsed) + window - limit * window / current
+    return max(1, math.floor(wait) + 1)
+
+
+class LocalStore:
+    """In-process counters, for single-node deployments and tests."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _slots(self, key, window, now):
+        index = int(now // window)
+        slot, previous, current = self._counters.get(key, (index, 0, 0))
+        if slot == index - 1:
+            previous, current = current, 0
+        elif slot != index:
+            previous, current = 0, 0
+        return index, previous, current
+
+    def counts(self, key, window, now):
+        with self._lock:
+            _, previous, current = self._slots(key, window, now)
+        return previous, current
+
+    def hit(self, key, window, now):
+        with self._lock:
+            index, previous, current = self._slots(key, window, now)
+            self._counters[key] = (index, previous, current + 1)
+            self._counters.move_to_end(key)
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+
+    def reset(self, key, window, now):
+        with self._lock:
+            self._counters.pop(key, None)
+
+
+class CacheStore:
+    """Counters in a Django cache shared by every node."""
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    def _keys(self, key, window, now):
+        index = int(now // window)
+        return f'rl:{key}:{index - 1}', f'rl:{key}:{index}'
+
+    def counts(self, key, window, now):
+        previous_key, current_key = self._keys(key, window, now)
+        counts = caches[self.alias].get_many([previous_key, current_key])
+        return counts.get(previous_key, 0), counts.get(current_key, 0)
+
+    def hit(self, key, window, now):
+        cache = caches[self.alias]
+        current_key = self._keys(key, window, now)[1]
+        cache.add(current_key, 0, timeout=int(2 * window) + 1)
+        try:
+            cache.incr(current_key)
+        except ValueError:
+            cache.set(current_key, 1, timeout=int(2 * window) + 1)
+
+    def reset(self, key, window, now):
+        caches[self.alias].delete_many(self._keys(key, window, now))
+
+
+class LoginThrottle:
+    """
+    Limits failed logins per client IP, per email and per (IP, email) pair. ``check`` runs before any password
+    is hashed and returns the seconds to wait if a limit is exhausted; ``failed`` records a failed attempt.
+    """
+
+    def __init__(self, store, limits, max_tracked_keys=1000):
+        self.store = store
+        self.limits = limits
+        self.max_tracked_keys = max_tracked_keys
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = {scope: 0 for scope in limits}
+        self.rejected_keys = OrderedDict()
+
+    def _keys(self, ip, email):
+        # Hashed: no addresses in the cache or in stats(), and keys stay short and free of spaces and control
+        # characters, which memcached rejects.
+        email = hashlib.sha256((email or '').strip().lower().encode()).hexdigest()
+        keys = {'ip': f'login:ip:{ip}', 'email': f'login:email:{email}', 'ip_email': f'login:ip_email:{ip}:{email}'}
+        return [(scope, keys[scope]) for scope in self.limits]
+
+    def check(self, ip, email):
+        now = time.time()
+        with self._lock:
+            self.checked += 1
+        for scope, key in self._keys(ip, email):
+            limit, window = self.limits[scope]
+            previous, current = self.store.counts(key, window, now)
+            if _estimate(previous, current, window, now) >= limit:
+                self._reject(scope, key)
+                return _retry_after(previous, current, limit, window, now)
+        return None
+
+    def failed(self, ip, email):
+        now = time.time()
+        for scope, key in self._keys(ip, email):
+            self.store.hit(key, self.limits[scope][1], now)
+
+    def succeeded(self, ip, email):
+        # A correct password clears the per-account counters, not the per-IP one.
+        now = time.time()
+        for scope, key in self._keys(ip, email):
+            if scope != 'ip':
+                self.store.reset(key, self.limits[scope][1], now)
+
+    def _reject(self, scope, key):
+        with self._lock:
+            self.rejected[scope] += 1
+            self.rejected_keys[key] = self.rejected_keys.pop(key, 0) + 1
+            while len(self.rejected_keys) > self.max_tracked_keys:
+                self.rejected_keys.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'checked': self.checked,
+                'rejected': dict(self.rejected),
+                'rejected_keys': dict(self.rejected_keys),
+            }
+
+
+def _build_store():
+    store = settings.LOGIN_RATE_LIMIT_STORE
+    if store == 'local':
+        return LocalStore()
+    if store == 'cache':
+        return CacheStore(settings.LOGIN_RATE_LIMIT_CACHE_ALIAS)
+    return import_string(store)()
+
+
+login_throttle = LoginThrottle(_build_store(), settings.LOGIN_RATE_LIMITS)
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
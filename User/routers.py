@@ -0,0 +1,66 @@
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+
+# True once the current request has written, so its later reads see its own writes. None outside a request
+# scope (background threads, commands): there a write pins nothing, or the thread would stay on the primary.
+_pinned = ContextVar('db_pinned_to_primary', default=None)
+_replica_down_until = {}
+
+
+def pin_to_primary(pinned=True):
+    """Open a request scope, already pinned if ``pinned``; close it with :func:`unpin`."""
+    return _pinned.set(pinned)
+
+
+def unpin(token):
+    _pinned.reset(token)
+
+
+def is_pinned():
+    return bool(_pinned.get())
+
+
+def _replica_available(alias):
+    now = time.monotonic()
+    if _replica_down_until.get(alias, 0) > now:
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError:
+        _replica_down_until[alias] = now + settings.DATABASE_REPLICA_RETRY_SECONDS
+        return False
+    return True
+
+
+class PrimaryReplicaRouter:
+    """
+    Send reads to a healthy replica from DATABASE_REPLICAS and everything else to the primary. Reads stay on the
+    primary inside transactions and after a write in the same request, or within DATABASE_REPLICA_PIN_SECONDS of
+    one by the same client (see ReplicaPinningMiddleware).
+    """
+
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = list(settings.DATABASE_REPLICAS)
+        random.shuffle(replicas)
+        for alias in replicas:
+            if _replica_available(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        if _pinned.get() is not None:
+            _pinned.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,153 @@
+import base64
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import ValidationError
+
+from .metrics import serializer_timer
+from .models import User
+from .pagination import Page
+
+SEARCH_FIELDS = ('first_name', 'last_name', 'email', 'username', 'bio')
+# Typeahead probes, in ranking order. Each is a LIMITed range scan on an index led by the field: the unique
+# indexes on username and email, and the (last_name, first_name) / (first_name, last_name) indexes on User.
+PREFIX_FIELDS = ('username', 'email', 'last_name', 'first_name')
+MAX_QUERY_LENGTH = 100
+
+FULLTEXT_INDEX = 'user_search_fulltext'
+FTS_TABLE = 'user_search'
+
+
+def parse_query(value):
+    query = ' '.join((value or '').split())
+    if not query:
+        raise ValidationError({'q': 'This parameter is required'})
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValidationError({'q': f'At most {MAX_QUERY_LENGTH} characters'})
+    return query
+
+
+def create_search_index(using):
+    """Create the vendor's full-text index over SEARCH_FIELDS if it is missing. Runs after migrate."""
+    connection = connections[using]
+    table = User._meta.db_table
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(User._meta.get_field(field).column) for field in SEARCH_FIELDS)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT 1 FROM information_schema.statistics '
+                'WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s', [table, FULLTEXT_INDEX])
+            if cursor.fetchone() is None:
+                cursor.execute(f'ALTER TABLE {quote(table)} ADD FULLTEXT INDEX {quote(FULLTEXT_INDEX)} ({columns})')
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            if cursor.fetchone() is not None:
+                return
+            # External content table: FTS5 stores only the index and reads the text back from the users table.
+            # The triggers keep it in step with every write, including bulk ones that bypass signals.
+            new = ', '.join(f'new.{quote(User._meta.get_field(field).column)}' for field in SEARCH_FIELDS)
+            old = ', '.join(f'old.{quote(User._meta.get_field(field).column)}' for field in SEARCH_FIELDS)
+            fts = quote(FTS_TABLE)
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({columns}, content='{table}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')")
+            cursor.execute(
+                f'CREATE TRIGGER {quote(FTS_TABLE + "_ai")} AFTER INSERT ON {quote(table)} BEGIN '
+                f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END')
+            cursor.execute(
+                f'CREATE TRIGGER {quote(FTS_TABLE + "_ad")} AFTER DELETE ON {quote(table)} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); END")
+            cursor.execute(
+                f'CREATE TRIGGER {quote(FTS_TABLE + "_au")} AFTER UPDATE ON {quote(table)} BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); "
+                f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END')
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def typeahead_ids(query, limit):
+    terms = query.split(' ', 1)
+    if len(terms) == 2:
+        # "ada lov" / "lovelace a": a name prefix on each side, served by the composite name indexes.
+        first, second = terms
+        probes = [
+            User.objects.filter(first_name__istartswith=first, last_name__istartswith=second)
+            .order_by('first_name', 'last_name'),
+            User.objects.filter(last_name__istartswith=first, first_name__istartswith=second)
+            .order_by('last_name', 'first_name'),
+        ]
+    else:
+        probes = [User.objects.filter(**{f'{field}__istartswith': query}).order_by(field) for field in PREFIX_FIELDS]
+    ids = {}
+    for probe in probes:
+        for pk in probe.values_list('pk', flat=True)[:limit]:
+            ids.setdefault(pk, None)
+        if len(ids) >= limit:
+            break
+    return list(ids)[:limit]
+
+
+def typeahead_page(serializer, query, limit):
+    """Up to ``limit`` users whose username, email or names start with ``query``, best matches first."""
+    ids = typeahead_ids(query, limit)
+    rows = {serializer.cursor(row)[1]: row for row in serializer.project(User.objects.filter(pk__in=ids))}
+    rows = [rows[pk] for pk in ids if pk in rows]
+    with serializer_timer():
+        results = [serializer.to_representation(row) for row in rows]
+    return Page(results, None)
+
+
+def ranked(queryset, query):
+    """``queryset`` narrowed to full-text matches for ``query`` and annotated with a relevance ``score``."""
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(User._meta.db_table)
+    if connection.vendor == 'mysql':
+        # Natural language mode; words shorter than innodb_ft_min_token_size or in the stopword list are ignored.
+        columns = ', '.join(connection.ops.quote_name(User._meta.get_field(f).column) for f in SEARCH_FIELDS)
+        match = f'MATCH ({columns}) AGAINST (%s IN NATURAL LANGUAGE MODE)'
+        return queryset.annotate(score=RawSQL(match, (query,), output_field=FloatField())).filter(
+            RawSQL(match, (query,), output_field=BooleanField()))
+    if connection.vendor == 'sqlite':
+        fts = connection.ops.quote_name(FTS_TABLE)
+        # Every term quoted, so user input is matched as words rather than parsed as FTS5 query syntax.
+        match = ' '.join('"%s"' % term.replace('"', '""') for term in query.split())
+        return queryset.annotate(score=RawSQL(
+            f'(SELECT -bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {table}.id)', (match,),
+            output_field=FloatField(),
+        )).filter(RawSQL(f'{table}.id IN (SELECT rowid FROM {fts} WHERE {fts} MATCH %s)', (match,),
+                         output_field=BooleanField()))
+    # No full-text index on other backends: unranked substring matching.
+    condition = Q()
+    for term in query.split():
+        condition &= Q(*[Q(**{f'{field}__icontains': term}) for field in SEARCH_FIELDS], _connector=Q.OR)
+    return queryset.filter(condition).annotate(score=Value(0.0, output_field=FloatField()))
+
+
+def encode_rank_cursor(score, pk):
+    return base64.urlsafe_b64encode(f'{score!r}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decode_rank_cursor(cursor):
+    try:
+        score, pk = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().rsplit('|', 1)
+        return float(score), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+
+
+def fulltext_page(serializer, query, page_size, cursor=None):
+    """One page of full-text matches, by descending score then id, continuing after ``cursor``."""
+    queryset = ranked(User.objects.all(), query)
+    if cursor:
+        score, pk = decode_rank_cursor(cursor)
+        queryset = queryset.filter(Q(score__lt=score) | Q(score=score, id__gt=pk))
+    rows = list(queryset.order_by('-score', 'id').values_list(*serializer.columns, 'score')[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        next_cursor = encode_rank_cursor(last[-1], serializer.cursor(last)[1])
+        rows = rows[:page_size]
+    with serializer_timer():
+        results = [serializer.to_representation(row) for row in rows]
+    return Page(results, next_cursor)
@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+
+from . import blobs, search
+from .authentication import user_cache
+from .imaging import schedule_renditions
+from .listcache import bump_activity_version, bump_version
+from .models import User
+from .pagination import LIST_FIELDS
+from .serializer import DERIVED_FIELDS
+
+
+# Columns behind the user list responses (see pagination.LIST_FIELDS and serializer.DERIVED_FIELDS).
+LISTED_FIELDS = frozenset(
+    column for field in LIST_FIELDS for column in DERIVED_FIELDS.get(field, (field,)))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_auth_cache(sender, instance, update_fields=None, **kwargs):
+    user_cache.invalidate(getattr(instance, api_settings.USER_ID_FIELD))
+    if update_fields is None:
+        bump_version()
+    elif update_fields & LISTED_FIELDS - {'last_login'}:
+        bump_version()
+    elif 'last_login' in update_fields:
+        # A login (Django's update_last_login): only the pages that list last_login change.
+        bump_activity_version()
+
+
+blobs.track_blob_field(User, 'avatar')
+
+
+@receiver(post_save, sender=User)
+def render_avatar(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    source = instance.avatar.name
+    if source and instance.avatar_renditions.get('source') != source:
+        transaction.on_commit(lambda: schedule_renditions(instance.pk, source))
+
+
+def create_search_index(sender, using, **kwargs):
+    search.create_search_index(using)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+from .uploads import CHUNK_SIZE, upload_temp_dir
+
+BLOB_PREFIX = 'blobs'
+# Spellings of the same format, so the same bytes uploaded as photo.JPEG and photo.jpg share one blob.
+EXTENSION_ALIASES = {'.jpeg': '.jpg', '.jpe': '.jpg', '.jfif': '.jpg', '.tif': '.tiff'}
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that names every file after the BLAKE2b digest of its bytes, so identical uploads share one
+    file (and, through its Blob row, one set of renditions). The bytes are hashed in the same pass that writes them;
+    an upload already spooled to disk is hashed and then renamed into place, or dropped if the blob exists.
+    Reference counts are kept by :func:`User.blobs.track_blob_field` and unreferenced blobs removed by
+    ``manage.py gc_blobs``.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Equal names mean equal content, so an existing file is never in the way.
+        return name
+
+    def blob_name(self, digest, extension):
+        return posixpath.join(BLOB_PREFIX, digest[:2], digest[2:4], digest + extension)
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        extension = os.path.splitext(name)[1].lower()
+        extension = EXTENSION_ALIASES.get(extension, extension)
+        hasher = hashlib.blake2b(digest_size=32)
+        if hasattr(content, 'temporary_file_path'):
+            source, spooled = content.temporary_file_path(), False
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+        else:
+            with tempfile.NamedTemporaryFile(dir=upload_temp_dir(), delete=False) as f:
+                source, spooled = f.name, True
+                content.seek(0)
+                for chunk in content.chunks(CHUNK_SIZE):
+                    hasher.update(chunk)
+                    f.write(chunk)
+        name = self.blob_name(hasher.hexdigest(), extension)
+        full_path = self.path(name)
+
+        # The row lock orders this against gc_blobs: either the collector has already removed the blob and it is
+        # written again below, or its grace period restarts now and the collector leaves it alone.
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and os.path.exists(full_path):
+                if blob.refcount <= 0:
+                    Blob.objects.filter(pk=blob.pk).update(unreferenced_at=timezone.now())
+                if spooled:
+                    os.remove(source)
+                return name
+
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # Overwriting is harmless: whatever is there has the same bytes.
+        file_move_safe(source, full_path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        Blob.objects.get_or_create(name=name, defaults={'size': os.path.getsize(full_path)})
+        return name
+
+
+blob_storage = ContentAddressedStorage()
@@ -1,3 +1,1049 @@
-from django.test import TestCase
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import datetime
+import io
+import json
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import PBKDF2SHA1PasswordHasher
+from django.contrib.auth.signals import user_logged_in, user_login_failed
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import OperationalError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenBackendExpiredToken
+
+from . import (activity, hashing, imaging, listcache, mailer, pagination, profiling, routers, serializer, uploads,
+               useragents)
+from .activity import ActivityCollector
+from .async_views import AsyncUserList
+from .authentication import AUTH_USER_FIELDS, cached_user
+from .denylist import BloomFilter, Denylist
+from .models import EmailVerificationToken, OutgoingEmail, RevokedToken, User, UserAgent, UserAgentInfo
+from .media import serve_media
+from .metrics import Registry, registry
+from .middleware import InstrumentationMiddleware, ProfilingMiddleware, ReplicaPinningMiddleware
+from .ratelimit import LocalStore, LoginThrottle
+from .storage import ContentAddressedStorage
+from .tokens import AccessToken, RefreshToken, build_service, get_token_service
+from .useragents import UserAgentCollector
+from .views import UserList, _openapi_schema, get_tokens_for_user
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', MAIL_DISPATCH_IN_PROCESS=False,
+                   MAIL_BATCH_SIZE=2, MAIL_MAX_ATTEMPTS=3, MAIL_RETRY_BACKOFF=30, MAIL_RETRY_BACKOFF_MAX=3600,
+                   MAIL_CLAIM_TIMEOUT=300)
+class MailerTests(TestCase):
+    def queue(self, n=1):
+        return [mailer.queue_mail(f'Subject {i}', 'Body', 'from@example.com', [f'to{i}@example.com'])
+                for i in range(n)]
+
+    def test_queue_mail_stores_a_pending_message_without_sending(self):
+        email, = self.queue()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.to, ['to0@example.com'])
+        self.assertEqual(mail.outbox, [])
+
+    def test_queue_mail_dispatches_after_commit_when_in_process(self):
+        with override_settings(MAIL_DISPATCH_IN_PROCESS=True), \
+                mock.patch.object(mailer._dispatcher, 'submit') as submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.queue()
+        submit.assert_called_once_with(mailer._dispatch_in_thread)
+
+    def test_aqueue_mail_dispatches_after_commit(self):
+        with override_settings(MAIL_DISPATCH_IN_PROCESS=True), \
+                mock.patch.object(mailer._dispatcher, 'submit') as submit:
+            with self.captureOnCommitCallbacks() as callbacks:
+                async_to_sync(mailer.aqueue_mail)('Subject', 'Body', 'from@example.com', ['to@example.com'])
+            submit.assert_not_called()
+            for callback in callbacks:
+                callback()
+        submit.assert_called_once_with(mailer._dispatch_in_thread)
+
+    def test_in_process_dispatch_arms_a_retry_for_backed_off_mail(self):
+        self.addCleanup(setattr, mailer, '_retry_at', None)
+        self.addCleanup(setattr, mailer, '_retry_timer', None)
+        self.queue()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')), \
+                mock.patch('User.mailer.close_old_connections'), \
+                mock.patch('User.mailer.threading.Timer') as timer:
+            mailer._dispatch_in_thread()
+        (delay, callback), _ = timer.call_args
+        self.assertAlmostEqual(delay, 30, delta=2)
+        self.assertIs(callback, mailer._retry_due)
+        timer.return_value.start.assert_called_once()
+
+    def test_dispatch_sends_one_batch(self):
+        self.queue(3)
+        self.assertEqual(mailer.dispatch_pending(), (2, 0))
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.SENT).count(), 2)
+        self.assertEqual(mailer.dispatch_pending(), (1, 0))
+        self.assertEqual(mailer.dispatch_pending(), (0, 0))
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_claimed_messages_are_leased(self):
+        self.queue(2)
+        batch = mailer._claim_batch(10)
+        self.assertEqual(len(batch), 2)
+        # A second worker sees nothing until the lease runs out.
+        self.assertEqual(mailer._claim_batch(10), [])
+        later = timezone.now() + datetime.timedelta(seconds=301)
+        with mock.patch('User.mailer.timezone.now', return_value=later):
+            self.assertEqual(len(mailer._claim_batch(10)), 2)
+
+    def test_failed_send_backs_off_then_gives_up(self):
+        email, = self.queue()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.assertEqual(mailer.dispatch_pending(), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts, email.last_error), (OutgoingEmail.PENDING, 1, 'down'))
+            self.assertGreater(email.next_attempt_at, timezone.now() + datetime.timedelta(seconds=29))
+            # Not due again before the backoff has passed.
+            self.assertEqual(mailer.dispatch_pending(), (0, 0))
+
+            for attempt in (2, 3):
+                OutgoingEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+                self.assertEqual(mailer.dispatch_pending(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.FAILED, 3))
+        self.assertEqual(mail.outbox, [])
+
+    def test_backoff_doubles_up_to_the_cap(self):
+        self.assertEqual(mailer._backoff(1), datetime.timedelta(seconds=30))
+        self.assertEqual(mailer._backoff(2), datetime.timedelta(seconds=60))
+        self.assertEqual(mailer._backoff(20), datetime.timedelta(seconds=3600))
+
+    def test_connection_failure_fails_the_whole_batch(self):
+        self.queue(2)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError('refused')):
+            self.assertEqual(mailer.dispatch_pending(), (0, 2))
+        self.assertEqual(OutgoingEmail.objects.filter(attempts=1, status=OutgoingEmail.PENDING).count(), 2)
+
+
+@override_settings(PASSWORD_HASHING_POOL='thread', PASSWORD_HASHING_WORKERS=1, PASSWORD_HASHING_MAX_PENDING=4,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher',
+                                     'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher'])
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        hashing.shutdown()
+        self.addCleanup(hashing.shutdown)
+        self.user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'correct horse')
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+
+    def test_login_goes_through_the_backend_and_its_signals(self):
+        failed = mock.Mock()
+        user_login_failed.connect(failed)
+        self.addCleanup(user_login_failed.disconnect, failed)
+
+        self.assertEqual(authenticate(None, email='ada@example.com', password='correct horse'), self.user)
+        self.assertIsNone(authenticate(None, email='ada@example.com', password='wrong'))
+        self.assertIsNone(authenticate(None, email='nobody@example.com', password='wrong'))
+        self.assertEqual(failed.call_count, 2)
+
+    def test_stale_hash_is_upgraded_on_login(self):
+        stale = PBKDF2SHA1PasswordHasher().encode('correct horse', PBKDF2SHA1PasswordHasher().salt(), iterations=1)
+        User.objects.filter(pk=self.user.pk).update(password=stale)
+        self.assertIsNotNone(authenticate(None, email='ada@example.com', password='correct horse'))
+        self.assertTrue(User.objects.get(pk=self.user.pk).password.startswith('md5$'))
+
+    def test_broken_pool_is_replaced(self):
+        broken = mock.Mock(submit=mock.Mock(side_effect=BrokenProcessPool))
+        self.addCleanup(hashing._get_executor().shutdown)
+        hashing._executor = broken
+        self.assertEqual(hashing.verify_password('correct horse', self.user.password), (True, False))
+        self.assertIsNot(hashing._executor, broken)
+        broken.shutdown.assert_called_once()
+
+    def test_saturated_pool_rejects(self):
+        # setUp's create_user already started the pool; the limit is only read when it starts.
+        hashing.shutdown()
+        with override_settings(PASSWORD_HASHING_MAX_PENDING=1):
+            hashing._get_executor()
+            hashing._slots.acquire()
+            try:
+                with self.assertRaises(hashing.HashingOverloaded):
+                    hashing.make_password('x')
+            finally:
+                hashing._slots.release()
+
+
+@override_settings(PASSWORD_HASHING_POOL='thread', MAIL_DISPATCH_IN_PROCESS=False)
+class AsyncRegistrationTests(TestCase):
+    url = '/auth/api/async/signup/'
+
+    def signup(self, **fields):
+        data = {'last_name': 'Lovelace', 'first_name': 'Ada', 'email': 'ada@example.com',
+                'password': 'an unguessable phrase', 'password2': 'an unguessable phrase', **fields}
+        return async_to_sync(self.async_client.post)(self.url, data, content_type='application/json')
+
+    def test_validates_like_the_sync_view(self):
+        for fields in ({'email': 'not an email'}, {'email': ['ada@example.com']},
+                       {'password': 'password', 'password2': 'password'}, {'password2': 'something else'}):
+            with self.subTest(fields=fields):
+                self.assertEqual(self.signup(**fields).status_code, 400)
+        self.assertFalse(User.objects.exists())
+
+    def test_a_failure_part_way_leaves_no_user(self):
+        with mock.patch('User.async_views.queue_mail', side_effect=OperationalError('outbox down')), \
+                self.assertRaises(OperationalError):
+            self.signup()
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(EmailVerificationToken.objects.exists())
+
+    def test_creates_an_inactive_user(self):
+        response = self.signup()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['username'], 'ada')
+        user = User.objects.get(email='ada@example.com')
+        self.assertFalse(user.is_active)
+        self.assertTrue(user.check_password('an unguessable phrase'))
+
+
+class LogoutTests(TestCase):
+    def test_refresh_token_of_another_user_is_not_revoked(self):
+        ada = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x', username='ada')
+        alan = User.objects.create_user('Alan', 'Turing', 'alan@example.com', 'x', username='alan')
+        User.objects.update(is_active=True)
+        foreign = get_tokens_for_user(alan)['refresh']
+        for url in ('/auth/api/logout/', '/auth/api/async/logout/'):
+            with self.subTest(url=url):
+                access = get_tokens_for_user(ada)['access']
+                response = self.client.post(url, {'refresh': foreign}, content_type='application/json',
+                                            HTTP_AUTHORIZATION=f'Bearer {access}')
+                self.assertEqual(response.status_code, 403)
+        self.assertFalse(RevokedToken.objects.exists())
+
+
+class BlobTests(TestCase):
+    def test_full_save_that_keeps_the_avatar_does_not_look_it_up(self):
+        user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x')
+        user = User.objects.get(pk=user.pk)
+        user.bio = 'Analyst'
+        with self.assertNumQueries(1):
+            user.save()
+
+    def test_extension_spellings_share_a_blob(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = ContentAddressedStorage(location=location)
+        names = {storage.save(name, ContentFile(b'same bytes')) for name in ('a.jpg', 'b.JPEG', 'c.jpe')}
+        self.assertEqual(len(names), 1)
+        self.assertTrue(names.pop().endswith('.jpg'))
+
+
+class ServeMediaTests(SimpleTestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        with open(f'{location}/a.txt', 'wb') as f:
+            f.write(b'hello')
+        media_root = override_settings(MEDIA_ROOT=location, MEDIA_SENDFILE='')
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def test_if_none_match_accepts_lists_and_weak_tags(self):
+        etag = serve_media(RequestFactory().get('/media/a.txt'), 'a.txt')['ETag']
+        for header in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+            with self.subTest(header=header):
+                request = RequestFactory().get('/media/a.txt', HTTP_IF_NONE_MATCH=header)
+                self.assertEqual(serve_media(request, 'a.txt').status_code, 304)
+        request = RequestFactory().get('/media/a.txt', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(serve_media(request, 'a.txt').status_code, 200)
+
+    def test_rendition_names_change_with_the_encoder_options(self):
+        pil_format, _, options = imaging.RENDITION_FORMATS['webp']
+        name = imaging.rendition_name('blobs/ab/cd/abcd.jpg', 256, 'webp')
+        self.assertIn(imaging.encoder_tag(pil_format, options), name)
+        self.assertNotEqual(imaging.encoder_tag(pil_format, {**options, 'quality': options['quality'] - 1}),
+                            imaging.encoder_tag(pil_format, options))
+
+
+class ActivityCollectorTests(SimpleTestCase):
+    def test_dropped_login_does_not_hide_the_next_one(self):
+        collector = ActivityCollector(granularity=60, flush_seconds=3600, batch_size=10, max_buffered=1)
+        now = timezone.now()
+        collector.record(1, now)
+        collector.record(2, now)
+        self.assertEqual(collector.stats()['dropped'], 1)
+
+        collector._buffer.clear()
+        collector.record(2, now + datetime.timedelta(seconds=1))
+        self.assertEqual(collector._buffer, {2: now + datetime.timedelta(seconds=1)})
+        collector.record(2, now + datetime.timedelta(seconds=2))
+        self.assertEqual(collector.stats()['coalesced'], 1)
+
+
+class ProfilingTests(TestCase):
+    def test_collapsed_output_is_reachable(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        patcher = mock.patch.object(profiling.store, 'directory', directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        name = profiling.store.save('users_endpoint', {
+            'shared': {'frames': [{'name': 'view', 'file': '/app/User/views.py', 'line': 1}]},
+            'profiles': [{'samples': [[0]], 'weights': [settings.PROFILING_INTERVAL * 3]}],
+        })
+        staff = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x')
+        User.objects.filter(pk=staff.pk).update(is_active=True, is_staff=True)
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {get_tokens_for_user(staff)['access']}"}
+
+        response = self.client.get(f'/auth/api/profiles/{name}/?output=collapsed', **auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'view (views.py:1) 3\n')
+
+    @override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0, PROFILING_VIEWS=set())
+    def test_async_views_are_not_sampled(self):
+        middleware = ProfilingMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get('/')
+        request.resolver_match = SimpleNamespace(url_name='users_endpoint')
+        middleware.process_view(request, AsyncUserList.as_view(), (), {})
+        self.assertNotIn('_profiler', request.__dict__)
+
+        middleware.process_view(request, UserList.as_view(), (), {})
+        self.assertIn('_profiler', request.__dict__)
+        request._profiler.stop()
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_runs_natively_under_asgi(self):
+        async def aget_response(request):
+            return HttpResponse()
+
+        middleware = ProfilingMiddleware(aget_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 200)
+
+
+class TokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x', username='ada')
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+
+    def test_authenticated_requests_and_refresh(self):
+        pair = get_tokens_for_user(self.user)
+        for url in ('/auth/api/users/', '/auth/api/async/users/'):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {pair['access']}")
+                self.assertEqual(response.status_code, 200)
+
+        response = self.client.post('/auth/api/token/refresh/', {'refresh': pair['refresh']},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        access = response.json()['access']
+        self.assertEqual(AccessToken(access)['user_id'], str(self.user.pk))
+        self.assertEqual(self.client.get('/auth/api/users/', HTTP_AUTHORIZATION=f'Bearer {access}').status_code, 200)
+
+    def test_round_trip_and_expiry(self):
+        service = build_service('HS256', 'k' * 32)
+        token = service.encode({'user_id': 1, 'exp': int(timezone.now().timestamp()) - 30})
+        with self.assertRaises(TokenBackendExpiredToken):
+            service.decode(token)
+        self.assertEqual(service.decode(token, verify=False)['user_id'], 1)
+        with self.assertRaises(TokenBackendError):
+            build_service('HS256', 'other' * 8).decode(token)
+
+        service.leeway = 60
+        self.assertEqual(service.decode(token)['user_id'], 1)
+
+    def test_follows_simple_jwt_overrides(self):
+        with override_settings(SIMPLE_JWT={**settings.SIMPLE_JWT, 'ISSUER': 'photo-test'}):
+            access = get_tokens_for_user(self.user)['access']
+            self.assertEqual(get_token_service().decode(access)['iss'], 'photo-test')
+        with self.assertRaises(TokenBackendError):
+            get_token_service().decode(access[:-2])
+
+    def test_minted_tokens_match_simplejwt(self):
+        pair = get_tokens_for_user(self.user)
+        stock = TokenBackend(settings.SIMPLE_JWT['ALGORITHM'], settings.SIMPLE_JWT['SIGNING_KEY'])
+        access, refresh = stock.decode(pair['access']), stock.decode(pair['refresh'])
+        self.assertEqual((access['token_type'], refresh['token_type']), ('access', 'refresh'))
+        self.assertEqual(access['user_id'], str(self.user.pk))
+        self.assertNotEqual(access['jti'], refresh['jti'])
+        self.assertEqual(access['exp'] - access['iat'],
+                         settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds())
+        # And the other way round: simplejwt's own tokens pass the service.
+        token = RefreshToken.for_user(User.objects.get(pk=self.user.pk))
+        self.assertEqual(get_token_service().decode(str(token)), token.payload)
+        self.assertEqual(list(get_token_service().tokens_for_user(self.user, refresh=False)), ['access'])
+
+
+class MiddlewareTests(TestCase):
+    def test_runs_natively_in_both_modes(self):
+        async def aget_response(request):
+            return HttpResponse()
+
+        for middleware in (InstrumentationMiddleware, ReplicaPinningMiddleware):
+            with self.subTest(middleware=middleware.__name__):
+                self.assertTrue(iscoroutinefunction(middleware(aget_response)))
+                self.assertFalse(iscoroutinefunction(middleware(lambda request: HttpResponse())))
+
+    def test_queries_of_async_requests_are_counted(self):
+        user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x', username='ada')
+        User.objects.filter(pk=user.pk).update(is_active=True)
+        key = ('photo_request_db_queries_total', (('view', 'async_users_endpoint'),))
+        before = registry.counters.get(key, 0)
+        response = async_to_sync(self.async_client.get)(
+            '/auth/api/async/users/', headers={'Authorization': f"Bearer {get_tokens_for_user(user)['access']}"})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(registry.counters[key], before)
+
+
+class ImportUsersTests(TestCase):
+    def import_users(self, name, content):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = f'{directory}/{name}'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_users', path, '--hashed', stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_bad_lines_are_reported_without_aborting(self):
+        stdout, stderr = self.import_users('users.ndjson', '\n'.join([
+            json.dumps({'email': 'ada@example.com', 'first_name': 'Ada'}),
+            '{"email": "broken@example.com",',
+            '[1, 2]',
+            json.dumps({'email': 'a-rather-long-local-part@example.com'}),
+            json.dumps({'email': 'alan@example.com', 'first_name': 'A' * 61}),
+            json.dumps({'email': 'grace@example.com', 'is_staff': 'yes'}),
+        ]) + '\n')
+        self.assertIn('Created 2 users, 4 conflicts', stdout)
+        for line in (2, 3, 4, 5):
+            self.assertIn(f'record {line}:', stderr)
+        self.assertIn('username', stderr)
+        self.assertEqual(set(User.objects.values_list('username', flat=True)), {'ada', 'grace'})
+        self.assertTrue(User.objects.get(username='grace').is_staff)
+
+    def test_over_long_csv_field_is_reported(self):
+        stdout, stderr = self.import_users('users.csv', 'email,last_name\nada@example.com,Lovelace\n'
+                                                        f"alan@example.com,{'T' * 51}\n")
+        self.assertIn('Created 1 users, 1 conflicts', stdout)
+        self.assertIn('record 2:', stderr)
+        self.assertIn('last_name', stderr)
+
+
+class ActivityFlushTests(TestCase):
+    def test_failed_chunks_are_requeued_and_written_ones_invalidate(self):
+        users = [User.objects.create_user('U', 'U', f'u{i}@example.com', 'x', username=f'u{i}') for i in range(3)]
+        collector = ActivityCollector(granularity=60, flush_seconds=3600, batch_size=1, max_buffered=10)
+        collector._thread = mock.Mock()  # no background flushes
+        now = timezone.now()
+        for user in users:
+            collector.record(user.pk, now)
+
+        calls = []
+
+        def flaky(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise OperationalError('lost connection')
+            return 1
+
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=flaky), \
+                mock.patch('User.listcache.bump_activity_version') as bump:
+            with self.assertRaises(OperationalError):
+                collector.flush()
+        bump.assert_called_once()
+        self.assertEqual(sorted(collector._buffer), [users[1].pk, users[2].pk])
+
+        later = now + datetime.timedelta(seconds=5)
+        collector._buffer[users[1].pk] = later
+        collector._requeue({users[1].pk: now})
+        self.assertEqual(collector._buffer[users[1].pk], later)
+        self.assertEqual(collector.flush(), 2)
+        self.assertIsNotNone(User.objects.get(pk=users[2].pk).last_login)
+
+
+class AsyncLoginTests(TestCase):
+    def test_throttle_runs_off_the_event_loop(self):
+        loops = []
+
+        def check(ip, email):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return 30
+
+        with mock.patch('User.async_views.login_throttle.check', side_effect=check):
+            response = async_to_sync(self.async_client.post)(
+                '/auth/api/async/login/', {'email': 'ada@example.com', 'password': 'x'},
+                content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(loops, [None])
+
+
+class UserListPaginationTests(TestCase):
+    def setUp(self):
+        caches[settings.USER_LIST_CACHE_ALIAS].clear()
+        start = timezone.now() - datetime.timedelta(days=1)
+        self.users = []
+        for i, name in enumerate(['ada', 'alan', 'grace', 'edsger', 'barbara']):
+            user = User.objects.create_user(name.title(), 'Test', f'{name}@example.com', 'x', username=name)
+            # Two users share a date_joined so the cursor has to break the tie on id.
+            User.objects.filter(pk=user.pk).update(date_joined=start + datetime.timedelta(minutes=i // 2),
+                                                   is_active=True)
+            self.users.append(user)
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {get_tokens_for_user(self.users[0])['access']}"}
+
+    def test_cursor_walks_every_row_once(self):
+        emails, query = [], {'page_size': 2, 'fields': 'email'}
+        while True:
+            response = self.client.get('/auth/api/users/', query, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            emails += [row['email'] for row in response.json()]
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                self.assertNotIn('Link', response.headers)
+                break
+            self.assertIn(f'cursor={cursor}', response.headers['Link'])
+            query['cursor'] = cursor
+        self.assertEqual(emails, [user.email for user in self.users])
+
+    def test_bad_parameters_are_rejected(self):
+        for query in ({'cursor': 'not-a-cursor'}, {'page_size': 0}, {'fields': 'password'}, {'stream': 'xml'}):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get('/auth/api/users/', query, **self.auth).status_code, 400)
+
+    def test_streams_every_row(self):
+        response = self.client.get('/auth/api/users/', {'stream': 'ndjson', 'fields': 'username,email'}, **self.auth)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'username': u.username, 'email': u.email} for u in self.users])
+
+        response = self.client.get('/auth/api/users/', {'stream': 'json', 'fields': 'username'}, **self.auth)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)),
+                         [{'username': u.username} for u in self.users])
+
+    @override_settings(USER_LIST_STREAM_CHUNK_SIZE=2)
+    def test_async_view_streams_in_chunks(self):
+        async def fetch():
+            response = await self.async_client.get(
+                '/auth/api/async/users/', {'stream': 'ndjson', 'fields': 'username'},
+                headers={'Authorization': self.auth['HTTP_AUTHORIZATION']})
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = async_to_sync(fetch)().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{'username': u.username} for u in self.users])
+
+
+class RenditionTests(SimpleTestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        media_root = override_settings(MEDIA_ROOT=location, MEDIA_URL='/media/', AVATAR_RENDITION_SIZES=(64, 256),
+                                       AVATAR_DEFAULT_SIZE=256)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def test_render_avatar_stores_every_size_and_format_without_exif(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        buffer = io.BytesIO()
+        Image.new('P', (600, 300)).save(buffer, 'PNG', exif=exif)
+        source = default_storage.save('avatars/ada.png', ContentFile(buffer.getvalue()))
+
+        renditions = imaging.render_avatar(source)
+        self.assertEqual(renditions['source'], source)
+        for size in (64, 256):
+            for extension, (pil_format, _, _) in imaging.RENDITION_FORMATS.items():
+                with self.subTest(size=size, extension=extension):
+                    name = renditions[str(size)][extension]
+                    self.assertEqual(name, imaging.rendition_name(source, size, extension))
+                    with default_storage.open(name) as f, Image.open(f) as image:
+                        self.assertEqual(image.format, pil_format)
+                        self.assertEqual(image.size, (size, size // 2))
+                        self.assertFalse(image.getexif())
+
+    def test_negotiates_size_and_format(self):
+        renditions = {'source': 'avatars/ada.png',
+                      **{str(size): {extension: f'r/{size}.{extension}' for extension in ('webp', 'jpeg')}
+                         for size in (64, 256)}}
+        factory = RequestFactory()
+        cases = [
+            (factory.get('/', {'avatar_size': 48}, HTTP_ACCEPT='image/webp,*/*'), 'r/64.webp'),
+            (factory.get('/', {'avatar_size': 100}), 'r/256.jpeg'),
+            (factory.get('/', {'avatar_size': 4096}, HTTP_ACCEPT='image/webp'), 'r/256.webp'),
+            (factory.get('/', {'avatar_size': 'big'}), 'r/256.jpeg'),
+        ]
+        for request, path in cases:
+            with self.subTest(query=request.GET.urlencode(), accept=request.META.get('HTTP_ACCEPT')):
+                size, extension = imaging.requested_rendition(request)
+                self.assertEqual(imaging.avatar_url('avatars/ada.png', renditions, size, extension),
+                                 f'/media/{path}')
+        # Renditions of a replaced avatar, or none yet: the original is served.
+        self.assertEqual(imaging.avatar_url('avatars/new.png', renditions, 64, 'jpeg'), '/media/avatars/new.png')
+        self.assertEqual(imaging.avatar_url('avatars/new.png', None, 64, 'jpeg'), '/media/avatars/new.png')
+        self.assertIsNone(imaging.avatar_url('', renditions, 64, 'jpeg'))
+
+
+class UserRowSerializerTests(TestCase):
+    def test_serializes_only_the_requested_fields(self):
+        user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x', username='ada')
+        joined = datetime.datetime(2024, 5, 1, 12, 30, 15, 120000, tzinfo=datetime.timezone.utc)
+        User.objects.filter(pk=user.pk).update(date_joined=joined)
+
+        row_serializer = serializer.UserRowSerializer(('email', 'date_joined', 'profile_photo_url'))
+        self.assertEqual(row_serializer.columns,
+                         ('email', 'date_joined', 'avatar', 'avatar_renditions', 'id'))
+        self.assertIs(serializer.UserRowSerializer(('email', 'date_joined', 'profile_photo_url'))._build,
+                      row_serializer._build)
+        row = row_serializer.project(User.objects.all()).get()
+        self.assertEqual(row_serializer.cursor(row), (joined, user.pk))
+        self.assertEqual(row_serializer.dumps(row_serializer.to_representation(row)),
+                         b'{"email":"ada@example.com","date_joined":"2024-05-01T12:30:15.120000Z",'
+                         b'"profile_photo_url":null}')
+
+    def test_only_listed_fields_can_be_requested(self):
+        self.assertEqual(pagination.parse_fields(None), pagination.DEFAULT_LIST_FIELDS)
+        self.assertEqual(pagination.parse_fields('email, id,email'), ('email', 'id'))
+        for value in ('password', 'email,is_superuser', ' , '):
+            with self.subTest(value=value), self.assertRaises(ValidationError):
+                pagination.parse_fields(value)
+
+
+class DenylistTests(TestCase):
+    def setUp(self):
+        self.denylist = Denylist(capacity=100, error_rate=0.01, sync_seconds=3600, rebuild_seconds=3600)
+
+    def token(self, jti, lifetime=300):
+        return {'jti': jti, 'exp': int(timezone.now().timestamp()) + lifetime}
+
+    def test_revoked_tokens_are_confirmed_against_the_table(self):
+        self.denylist.revoke(self.token('a'))
+        self.assertTrue(self.denylist.is_revoked('a'))
+        with self.assertNumQueries(0):
+            self.assertFalse(self.denylist.is_revoked('b'))
+        self.assertEqual(self.denylist.stats(), {'checks': 2, 'lookups': 1, 'revoked': 1, 'entries': 1})
+
+    def test_false_positive_falls_back_to_the_table(self):
+        self.denylist.sync()
+        with mock.patch.object(BloomFilter, '__contains__', return_value=True), self.assertNumQueries(1):
+            self.assertFalse(self.denylist.is_revoked('never-revoked'))
+        self.assertEqual(self.denylist.lookups, 1)
+        self.assertEqual(self.denylist.revoked, 0)
+
+    def test_expired_tokens_are_neither_stored_nor_revoked(self):
+        self.denylist.revoke(self.token('gone', lifetime=-1))
+        self.assertFalse(RevokedToken.objects.exists())
+
+        past = timezone.now() - datetime.timedelta(seconds=1)
+        RevokedToken.objects.create(jti='lapsed', expires_at=past)
+        with mock.patch.object(BloomFilter, '__contains__', return_value=True):
+            self.assertFalse(self.denylist.is_revoked('lapsed'))
+        self.assertEqual(self.denylist.stats()['entries'], 0)
+
+    def test_picks_up_revocations_from_other_processes(self):
+        self.assertFalse(self.denylist.is_revoked('elsewhere'))
+        RevokedToken.objects.create(jti='elsewhere', expires_at=timezone.now() + datetime.timedelta(minutes=5))
+        self.assertFalse(self.denylist.is_revoked('elsewhere'))
+        self.denylist._next_sync = 0
+        self.assertTrue(self.denylist.is_revoked('elsewhere'))
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        people = [('Ada', 'Lovelace', 'ada', 'Wrote the first program for the analytical engine'),
+                  ('Alan', 'Turing', 'alan', 'Broke codes; the engine of modern computing theory'),
+                  ('Grace', 'Hopper', 'grace', 'Built the first compiler, and found a moth')]
+        for first_name, last_name, username, bio in people:
+            User.objects.create_user(first_name, last_name, f'{username}@example.com', 'x', username=username,
+                                     bio=bio)
+        User.objects.update(is_active=True)
+        user = User.objects.get(username='ada')
+        self.auth = {'HTTP_AUTHORIZATION': f"Bearer {get_tokens_for_user(user)['access']}"}
+
+    def search(self, **query):
+        response = self.client.get('/auth/api/users/search/', {'fields': 'username', **query}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return [row['username'] for row in response.json()], response
+
+    def test_prefix_matches_names_in_either_order(self):
+        self.assertEqual(self.search(q='a')[0], ['ada', 'alan'])
+        self.assertEqual(self.search(q='HOP')[0], ['grace'])
+        self.assertEqual(self.search(q='ada  lov')[0], ['ada'])
+        self.assertEqual(self.search(q='turing a')[0], ['alan'])
+        self.assertEqual(self.search(q='a', page_size=1)[0], ['ada'])
+
+    def test_fulltext_ranks_and_pages(self):
+        self.assertEqual(self.search(q='compiler', mode='fulltext')[0], ['grace'])
+        self.assertEqual(self.search(q='Compilers', mode='fulltext')[0], [])
+        # Query syntax is matched as words, not parsed.
+        self.assertEqual(self.search(q='"moth" OR NEAR(', mode='fulltext')[0], [])
+
+        usernames, query = [], {'q': 'engine', 'mode': 'fulltext', 'page_size': 1}
+        while True:
+            page, response = self.search(**query)
+            usernames += page
+            if 'X-Next-Cursor' not in response.headers:
+                break
+            query['cursor'] = response.headers['X-Next-Cursor']
+        self.assertEqual(sorted(usernames), ['ada', 'alan'])
+
+        # Edits reach the index.
+        User.objects.filter(username='alan').update(bio='Cryptanalyst')
+        self.assertEqual(self.search(q='engine', mode='fulltext')[0], ['ada'])
+
+    def test_bad_queries_are_rejected(self):
+        for query in ({}, {'q': '   '}, {'q': 'a' * 101}, {'q': 'a', 'mode': 'fuzzy'},
+                      {'q': 'a', 'mode': 'fulltext', 'cursor': '!'}):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get('/auth/api/users/search/', query, **self.auth).status_code, 400)
+
+
+class ApiSettingsTests(TestCase):
+    def test_profile_drops_what_api_workers_never_serve(self):
+        from Photo import settings_api
+
+        self.assertEqual(settings_api.INSTALLED_APPS,
+                         [app for app in settings.INSTALLED_APPS if app not in settings_api.API_DROPPED_APPS])
+        self.assertIn('User.apps.UserConfig', settings_api.INSTALLED_APPS)
+        if settings_api.AUTH_LOGIN_MODE == 'jwt':
+            self.assertNotIn('django.contrib.sessions.middleware.SessionMiddleware', settings_api.MIDDLEWARE)
+        self.assertEqual(settings_api.TEMPLATES, [])
+        self.assertEqual(settings_api.REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'],
+                         ('rest_framework.renderers.JSONRenderer',))
+        self.assertEqual(settings_api.REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'],
+                         settings.REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'])
+
+    @override_settings(ROOT_URLCONF='Photo.urls_api')
+    def test_urlconf_serves_the_api_and_the_prebuilt_schema(self):
+        user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x', username='ada')
+        User.objects.filter(pk=user.pk).update(is_active=True)
+        access = get_tokens_for_user(user)['access']
+        self.assertEqual(self.client.get('/auth/api/users/', HTTP_AUTHORIZATION=f'Bearer {access}').status_code, 200)
+        for path in ('/admin/', '/api/swagger'):
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(_openapi_schema.cache_clear)
+        with override_settings(OPENAPI_SCHEMA_FILE=f'{directory}/openapi.json'):
+            _openapi_schema.cache_clear()
+            self.assertEqual(self.client.get('/api/openapi.json').status_code, 404)
+            with open(f'{directory}/openapi.json', 'wb') as f:
+                f.write(b'{"swagger": "2.0"}')
+            _openapi_schema.cache_clear()
+            response = self.client.get('/api/openapi.json')
+            self.assertEqual(response.json(), {'swagger': '2.0'})
+            self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+
+class LoginModeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'a long passphrase',
+                                             username='ada')
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        self.logins = []
+        receiver = lambda sender, user, **kwargs: self.logins.append(user.pk)  # noqa: E731
+        user_logged_in.connect(receiver)
+        self.addCleanup(user_logged_in.disconnect, receiver)
+        # Write the logins' buffered activity while the test database is still there.
+        self.addCleanup(activity.collector.flush)
+        self.addCleanup(useragents.collector.flush)
+
+    def login(self, url):
+        credentials = {'email': 'ada@example.com', 'password': 'a long passphrase'}
+        if url.startswith('/auth/api/async/'):
+            return async_to_sync(self.async_client.post)(url, credentials, content_type='application/json')
+        return self.client.post(url, credentials, content_type='application/json')
+
+    @override_settings(AUTH_LOGIN_MODE='jwt')
+    def test_jwt_mode_writes_no_session(self):
+        for url in ('/auth/api/login/', '/auth/api/async/login/'):
+            with self.subTest(url=url):
+                response = self.login(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('access', response.json()['tokens'])
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(self.logins, [self.user.pk, self.user.pk])
+        self.assertFalse(Session.objects.exists())
+
+    @override_settings(AUTH_LOGIN_MODE='session')
+    def test_session_mode_logs_into_a_session(self):
+        for url in ('/auth/api/login/', '/auth/api/async/login/'):
+            with self.subTest(url=url):
+                response = self.login(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(self.logins, [self.user.pk, self.user.pk])
+
+    def test_purge_sessions_keeps_live_ones(self):
+        now = timezone.now()
+        Session.objects.bulk_create([
+            Session(session_key=f'expired{i}', session_data='', expire_date=now - datetime.timedelta(days=1))
+            for i in range(3)
+        ] + [Session(session_key='live', session_data='', expire_date=now + datetime.timedelta(days=1))])
+        out = io.StringIO()
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db'):
+            call_command('purge_sessions', batch_size=2, stdout=out)
+        self.assertIn('Deleted 3 expired sessions', out.getvalue())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+        out = io.StringIO()
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies'):
+            call_command('purge_sessions', stdout=out)
+        self.assertIn('nothing to purge', out.getvalue())
+
+
+class CachedUserTests(TestCase):
+    def test_cached_user_matches_an_only_query(self):
+        user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x')
+        User.objects.filter(pk=user.pk).update(is_active=True)
+        loaded = User.objects.only(*AUTH_USER_FIELDS).get(pk=user.pk)
+        cached = cached_user({'is_staff': False, 'email': 'ada@example.com', 'is_active': True, 'id': user.pk})
+        self.assertEqual(cached, loaded)
+        self.assertEqual((cached.email, cached.is_active, cached.is_staff), ('ada@example.com', True, False))
+        self.assertEqual(cached.get_deferred_fields(), loaded.get_deferred_fields())
+        self.assertFalse(cached._state.adding)
+        # Deferred fields load on access.
+        self.assertEqual(cached.first_name, 'Ada')
+
+    def test_deactivation_reaches_cached_token_users(self):
+        user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x', username='ada')
+        User.objects.filter(pk=user.pk).update(is_active=True)
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {get_tokens_for_user(user)['access']}"}
+        self.assertEqual(self.client.get('/auth/api/users/', **auth).status_code, 200)
+
+        user = User.objects.get(pk=user.pk)
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get('/auth/api/users/', **auth).status_code, 401)
+
+
+class TrickleStream:
+    """A request stream that hands out at most ``step`` bytes per read."""
+
+    def __init__(self, data, step):
+        self.data, self.step = data, step
+
+    def read(self, size):
+        chunk, self.data = self.data[:min(size, self.step)], self.data[min(size, self.step):]
+        return chunk
+
+
+class AppendChunkTests(SimpleTestCase):
+    png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 40
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        temp_dir = override_settings(FILE_UPLOAD_TEMP_DIR=directory)
+        temp_dir.enable()
+        self.addCleanup(temp_dir.disable)
+        self.upload = SimpleNamespace(pk='part')
+
+    def test_magic_bytes_split_across_reads_and_chunks(self):
+        self.assertEqual(uploads.append_chunk(self.upload, TrickleStream(self.png[:5], 3), 0, 5), 5)
+        rest = self.png[5:]
+        self.assertEqual(uploads.append_chunk(self.upload, TrickleStream(rest, 4), 5, len(rest)), len(rest))
+        with open(uploads.part_path(self.upload), 'rb') as part:
+            self.assertEqual(part.read(), self.png)
+
+    def test_wrong_magic_bytes_are_rejected_once_complete(self):
+        uploads.append_chunk(self.upload, TrickleStream(b'GIF89a', 2), 0, 6)
+        with self.assertRaises(ValueError):
+            uploads.append_chunk(self.upload, TrickleStream(b'\x00' * 20, 2), 6, 20)
+
+    def test_missing_part_file(self):
+        with self.assertRaises(uploads.MissingPart):
+            uploads.append_chunk(self.upload, TrickleStream(self.png[20:], 8), 20, len(self.png) - 20)
+        uploads.append_chunk(self.upload, TrickleStream(self.png[:10], 8), 0, 10)
+        with self.assertRaises(uploads.MissingPart):
+            uploads.append_chunk(self.upload, TrickleStream(self.png[20:], 8), 20, len(self.png) - 20)
+
+
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def test_writes_pin_only_inside_a_request_scope(self):
+        router = routers.PrimaryReplicaRouter()
+        router.db_for_write(User)
+        self.assertFalse(routers.is_pinned())
+
+        token = routers.pin_to_primary(False)
+        try:
+            router.db_for_write(User)
+            self.assertTrue(routers.is_pinned())
+        finally:
+            routers.unpin(token)
+        self.assertFalse(routers.is_pinned())
+
+    def test_background_threads_are_never_pinned(self):
+        token = routers.pin_to_primary(True)
+        self.addCleanup(routers.unpin, token)
+        seen = []
+
+        def work():
+            routers.PrimaryReplicaRouter().db_for_write(User)
+            seen.append(routers.is_pinned())
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [False])
+
+
+class VerifyEmailTests(TestCase):
+    def test_token_is_single_use(self):
+        user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x')
+        token = EmailVerificationToken.issue(user)
+        url = f'/auth/api/verify-email/{token}/'
+
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(User.objects.get(pk=user.pk).is_active)
+        self.assertFalse(EmailVerificationToken.objects.filter(user=user).exists())
+
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertFalse(User.objects.get(pk=user.pk).is_active)
+
+
+class UserAgentCollectorTests(TestCase):
+    def setUp(self):
+        self.collector = UserAgentCollector(flush_events=100, flush_seconds=3600, max_buffered=3)
+        self.collector._thread = mock.Mock()  # no background flushes
+        self.user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x', username='ada')
+
+    def test_flush_writes_each_pair_once(self):
+        for agent in ('curl/8', 'curl/8', 'Firefox'):
+            self.collector.record(self.user.pk, agent)
+        self.assertEqual(self.collector.flush(), 2)
+        self.assertEqual(UserAgentInfo.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(UserAgent.objects.count(), 2)
+
+    def test_sightings_of_deleted_users_are_skipped(self):
+        other = User.objects.create_user('Bob', 'B', 'bob@example.com', 'x', username='bob')
+        self.collector.record(self.user.pk, 'curl/8')
+        self.collector.record(other.pk, 'curl/8')
+        other.delete()
+        self.assertEqual(self.collector.flush(), 1)
+
+    def test_failed_flush_is_requeued(self):
+        self.collector.record(self.user.pk, 'curl/8')
+        with mock.patch.object(self.collector, '_write', side_effect=OperationalError('gone away')):
+            with self.assertRaises(OperationalError):
+                self.collector.flush()
+        self.assertEqual(self.collector.flush(), 1)
+        self.assertEqual(self.collector.dropped, 0)
+
+
+class ListCacheVersionTests(TestCase):
+    def setUp(self):
+        caches[settings.USER_LIST_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user('Ada', 'Lovelace', 'ada@example.com', 'x')
+        self.factory = RequestFactory()
+
+    def versions(self):
+        cache = caches[settings.USER_LIST_CACHE_ALIAS]
+        return cache.get(listcache.VERSION_KEY), cache.get(listcache.ACTIVITY_VERSION_KEY)
+
+    def test_only_listed_fields_invalidate_every_page(self):
+        before = self.versions()
+        self.user.password = 'changed'
+        self.user.save(update_fields=['password'])
+        self.assertEqual(self.versions(), before)
+
+        self.user.bio = 'changed'
+        self.user.save(update_fields=['bio'])
+        self.assertNotEqual(self.versions()[0], before[0])
+
+    def test_logins_only_invalidate_pages_listing_last_login(self):
+        plain = self.factory.get('/auth/api/users/')
+        with_login = self.factory.get('/auth/api/users/', {'fields': 'email,last_login'})
+        keys = listcache.cache_key(plain), listcache.cache_key(with_login)
+
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(listcache.cache_key(plain), keys[0])
+        self.assertNotEqual(listcache.cache_key(with_login), keys[1])
+
+    def test_last_modified_moves_on_delete(self):
+        request = self.factory.get('/auth/api/users/')
+        before = listcache.cache_key(request)
+        with mock.patch('User.listcache.time.time_ns', return_value=(before.last_modified + 5) * 10 ** 9):
+            self.user.delete()
+        after = listcache.cache_key(request)
+        self.assertNotEqual(after.name, before.name)
+        self.assertEqual(after.last_modified, before.last_modified + 5)
+
+
+class DumpsTests(SimpleTestCase):
+    def test_datetimes_do_not_depend_on_orjson(self):
+        value = {'at': datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+                 'whole': datetime.datetime(2024, 5, 1, 12, 30, 15, tzinfo=datetime.timezone.utc)}
+        expected = b'{"at":"2024-05-01T12:30:15.123456Z","whole":"2024-05-01T12:30:15Z"}'
+        with mock.patch('User.serializer.orjson', None):
+            self.assertEqual(json.loads(serializer.dumps(value)), json.loads(expected))
+        if serializer.orjson is not None:
+            self.assertEqual(serializer.dumps(value), expected)
+
+
+class LoginThrottleTests(SimpleTestCase):
+    def setUp(self):
+        self.throttle = LoginThrottle(LocalStore(), {'email': (3, 300)})
+
+    def test_keys_carry_no_raw_email(self):
+        (_, key), = self.throttle._keys('10.0.0.1', ' Ada Lovelace@Example.com\n')
+        self.assertNotIn('lovelace', key.lower())
+        self.assertRegex(key, r'^login:email:[0-9a-f]{64}$')
+        self.assertEqual(self.throttle._keys('10.0.0.1', 'ada lovelace@example.com'),
+                         self.throttle._keys('10.0.0.2', ' ADA LOVELACE@example.com '))
+
+    def test_retry_after_ends_when_old_hits_slide_out(self):
+        with mock.patch('User.ratelimit.time.time', return_value=3000.0):  # the start of a window
+            for _ in range(4):
+                self.throttle.failed('10.0.0.1', 'ada@example.com')
+        with mock.patch('User.ratelimit.time.time', return_value=3000.0 + 310):
+            wait = self.throttle.check('10.0.0.1', 'ada@example.com')
+        # 4 hits from the previous window weigh 4 * (300 - elapsed) / 300: under 3 once elapsed passes 75 s.
+        self.assertEqual(wait, 66)
+        with mock.patch('User.ratelimit.time.time', return_value=3000.0 + 310 + wait):
+            self.assertIsNone(self.throttle.check('10.0.0.1', 'ada@example.com'))
+
+
+class RegistryTests(SimpleTestCase):
+    def test_render_types_extra_samples(self):
+        registry = Registry()
+        registry.inc('photo_requests_total', (('view', 'users_endpoint'),))
+        text = registry.render([('photo_cache_hits', (), 3, 'counter'), ('photo_cache_size', (), 7, 'gauge')])
+        self.assertIn('# TYPE photo_requests_total counter', text)
+        self.assertIn('# TYPE photo_cache_hits counter\nphoto_cache_hits 3', text)
+        self.assertIn('# TYPE photo_cache_size gauge\nphoto_cache_size 7', text)
+
+    def test_render_while_histograms_are_added(self):
+        registry = Registry()
+
+        def add():
+            for i in range(500):
+                registry.histogram('photo_request_duration_seconds', (('view', str(i)),)).observe(0.01)
+
+        thread = threading.Thread(target=add)
+        thread.start()
+        # Render while the other thread inserts; the fixed insert count bounds how long this takes.
+        while thread.is_alive():
+            registry.render()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(registry.render().count('photo_request_duration_seconds_count{'), 500)
@@ -0,0 +1,161 @@
+import base64
+import json
+import time
+import uuid
+from functools import lru_cache
+
+import jwt
+from django.core.exceptions import ImproperlyConfigured
+from jwt.algorithms import get_default_algorithms
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework_simplejwt import settings as jwt_settings, tokens
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenBackendExpiredToken
+from rest_framework_simplejwt.settings import api_settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+class TokenService(TokenBackend):
+    """
+    SimpleJWT's TokenBackend with a faster path for the common case. The keys are parsed once (a PEM parse per
+    token dominates RS/ES/EdDSA signing) and the encoded header and static claims are built once, so minting a
+    token is a JSON dump of its few dynamic claims plus one signature. A JWKS URL or a custom JSON encoder goes
+    through TokenBackend unchanged.
+    """
+
+    def __init__(self, algorithm, signing_key, verifying_key, access_lifetime, refresh_lifetime,
+                 audience=None, issuer=None, leeway=0, jwk_url=None, json_encoder=None):
+        try:
+            self._algorithm = get_default_algorithms()[algorithm]
+        except KeyError:
+            raise ImproperlyConfigured(f'Unsupported JWT algorithm {algorithm!r} (RS/ES/EdDSA need cryptography)')
+        super().__init__(algorithm, signing_key, verifying_key, audience=audience, issuer=issuer,
+                         jwk_url=jwk_url, leeway=leeway, json_encoder=json_encoder)
+        self._signing_key = self._algorithm.prepare_key(signing_key)
+        if verifying_key:
+            self._verifying_key = self._algorithm.prepare_key(verifying_key)
+        else:
+            # HMAC verifies with the secret itself, asymmetric algorithms with the private key's public half.
+            public_key = getattr(self._signing_key, 'public_key', None)
+            self._verifying_key = public_key() if public_key else self._signing_key
+        # TokenBackend's own methods (get_verifying_key) see the keys parsed above.
+        self.__dict__['prepared_signing_key'] = self._signing_key
+        self.__dict__['prepared_verifying_key'] = self._verifying_key
+        self._header = _b64(_dumps({'alg': algorithm, 'typ': 'JWT'})) + b'.'
+        self.lifetimes = {
+            tokens.AccessToken.token_type: int(access_lifetime.total_seconds()),
+            tokens.RefreshToken.token_type: int(refresh_lifetime.total_seconds()),
+        }
+        self._static = {}
+        if audience is not None:
+            self._static['aud'] = audience
+        if issuer is not None:
+            self._static['iss'] = issuer
+
+    def encode(self, payload):
+        if self.json_encoder is not None:
+            return super().encode(payload)
+        payload = {**self._static, **payload}
+        signing_input = self._header + _b64(_dumps(payload))
+        return (signing_input + b'.' + _b64(self._algorithm.sign(signing_input, self._signing_key))).decode()
+
+    def decode(self, token, verify=True):
+        if self.jwks_client is not None:
+            return super().decode(token, verify)
+        # Same contract as TokenBackend.decode, with the verifying key already parsed.
+        try:
+            return jwt.decode(
+                token, self._verifying_key, algorithms=[self.algorithm], audience=self.audience,
+                issuer=self.issuer, leeway=self.get_leeway(),
+                options={'verify_aud': self.audience is not None, 'verify_signature': verify},
+            )
+        except jwt.InvalidAlgorithmError:
+            raise TokenBackendError('Invalid algorithm specified')
+        except jwt.ExpiredSignatureError:
+            raise TokenBackendExpiredToken('Token is expired')
+        except jwt.InvalidTokenError:
+            raise TokenBackendError('Token is invalid')
+
+    def _claims(self, user_id, token_type, now):
+        return {
+            api_settings.TOKEN_TYPE_CLAIM: token_type,
+            'exp': now + self.lifetimes[token_type],
+            'iat': now,
+            api_settings.JTI_CLAIM: uuid.uuid4().hex,
+            api_settings.USER_ID_CLAIM: user_id,
+        }
+
+    def tokens_for_user(self, user, refresh=True):
+        """``{'access': ...}``, plus ``'refresh'`` unless ``refresh`` is false."""
+        # A string, as RefreshToken.for_user writes it, so both kinds of token carry the same claim.
+        user_id = str(getattr(user, api_settings.USER_ID_FIELD))
+        now = int(time.time())
+        result = {'access': self.encode(self._claims(user_id, tokens.AccessToken.token_type, now))}
+        if refresh:
+            result['refresh'] = self.encode(self._claims(user_id, tokens.RefreshToken.token_type, now))
+        return result
+
+
+def build_service(algorithm=None, signing_key=None, verifying_key=None):
+    """A service with the SIMPLE_JWT lifetimes and claims, and its keys unless ``signing_key`` is given."""
+    # Looked up on the module: SimpleJWT rebinds it when SIMPLE_JWT changes (override_settings).
+    api_settings = jwt_settings.api_settings
+    if signing_key is None:
+        signing_key, verifying_key = api_settings.SIGNING_KEY, api_settings.VERIFYING_KEY
+    return TokenService(
+        algorithm or api_settings.ALGORITHM,
+        signing_key,
+        verifying_key,
+        api_settings.ACCESS_TOKEN_LIFETIME,
+        api_settings.REFRESH_TOKEN_LIFETIME,
+        audience=api_settings.AUDIENCE,
+        issuer=api_settings.ISSUER,
+        leeway=api_settings.LEEWAY,
+        jwk_url=api_settings.JWK_URL,
+        json_encoder=api_settings.JSON_ENCODER,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_token_service():
+    """The service for the current SIMPLE_JWT settings, built on first use."""
+    return build_service()
+
+
+@receiver(setting_changed)
+def _reset_token_service(setting, **kwargs):
+    if setting == 'SIMPLE_JWT':
+        get_token_service.cache_clear()
+
+
+class AccessToken(tokens.AccessToken):
+    def get_token_backend(self):
+        return get_token_service()
+
+
+class RefreshToken(tokens.RefreshToken):
+    access_token_class = AccessToken
+
+    def get_token_backend(self):
+        return get_token_service()
+
+
+def issued_to(token, user):
+    """Whether ``token`` carries ``user``'s id in its user id claim."""
+    user_id = getattr(user, api_settings.USER_ID_FIELD, None)
+    return user_id is not None and str(token.get(api_settings.USER_ID_CLAIM)) == str(user_id)
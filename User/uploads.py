@@ -0,0 +1,116 @@
+import os
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+AVATAR_EXTENSIONS = ['jpeg', 'jpg', 'png', 'webp']
+SNIFF_BYTES = 12
+CHUNK_SIZE = 64 * 2 ** 10
+
+
+def sniff_image_type(head):
+    """Identify an allowed image format from its first bytes, or return None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def upload_temp_dir():
+    # Outside MEDIA_ROOT, so partial uploads are never served, but on its filesystem so the final save is a rename.
+    os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+    return settings.FILE_UPLOAD_TEMP_DIR
+
+
+class AvatarUploadHandler(FileUploadHandler):
+    """
+    Gatekeeper in front of Django's memory/temporary-file handlers for avatar fields: it checks the magic bytes of
+    the first chunk and the running size, and aborts the request as soon as either is wrong, so the rest of the
+    body is neither read nor written. Chunks are passed through untouched to the next handler.
+    """
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.active = field_name in settings.AVATAR_UPLOAD_FIELDS
+        self.received = 0
+        self.head = b''
+        if self.active:
+            upload_temp_dir()
+            if content_length and content_length > settings.AVATAR_MAX_UPLOAD_SIZE:
+                self.reject('Image file too large')
+
+    def reject(self, message):
+        self.request.upload_error = message
+        raise StopUpload(connection_reset=True)
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.received += len(raw_data)
+        if self.received > settings.AVATAR_MAX_UPLOAD_SIZE:
+            self.reject('Image file too large')
+        if len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES and sniff_image_type(self.head) is None:
+                self.reject('Unsupported image format')
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.active and sniff_image_type(self.head) is None:
+            self.reject('Unsupported image format')
+        return None
+
+
+class PartialUploadFile(File):
+    """A finished resumable upload; ``temporary_file_path`` lets FileSystemStorage move it into place."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def part_path(upload):
+    return os.path.join(upload_temp_dir(), f'{upload.pk}.part')
+
+
+class MissingPart(Exception):
+    """The part file of a resumable upload is gone or shorter than what was acknowledged."""
+
+
+def append_chunk(upload, stream, start, length):
+    """Append ``length`` bytes from ``stream`` at ``start`` and return how many were written."""
+    written = 0
+    try:
+        part = open(part_path(upload), 'r+b' if start else 'wb')
+    except FileNotFoundError:
+        raise MissingPart
+    with part:
+        if os.fstat(part.fileno()).st_size < start:
+            raise MissingPart
+        # The format is checked once SNIFF_BYTES have arrived, however the client and the reads split them.
+        head = (part.read(start) if start else b'') if start < SNIFF_BYTES else None
+        part.seek(start)
+        while written < length:
+            data = stream.read(min(CHUNK_SIZE, length - written))
+            if not data:
+                break
+            if head is not None:
+                head += data[:SNIFF_BYTES - len(head)]
+                if len(head) >= SNIFF_BYTES:
+                    if sniff_image_type(head) is None:
+                        raise ValueError('Unsupported image format')
+                    head = None
+            part.write(data)
+            written += len(data)
+        part.truncate()
+    return written
+
+
+def discard(upload):
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
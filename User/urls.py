@@ -1,5 +1,8 @@
 from django.urls import path
-from User.views import LoginView, UserList, LogoutView, RegistrationView, send_verification_email
+from User.views import LoginView, UserList, LogoutView, RegistrationView, send_verification_email, \
+    AvatarUploadView, AvatarUploadChunkView, VerifyEmailView, DenylistTokenRefreshView, \
+    UserSearch, ProfileList, ProfileDetail
+from User.async_views import AsyncLoginView, AsyncLogoutView, AsyncRegistrationView, AsyncUserList
 
 app_name= 'User'
 
@@ -7,8 +10,21 @@ urlpatterns =[
      path('api/login/', LoginView.as_view(), name='login_endpoint'),
      path('api/logout/', LogoutView.as_view(), name='logout_endpoint'),
      path('api/users/', UserList.as_view(), name='users_endpoint'),
+     path('api/users/search/', UserSearch.as_view(), name='users_search_endpoint'),
      path('api/signup/', RegistrationView.as_view(), name='signup_endpoint'),
+     path('api/token/refresh/', DenylistTokenRefreshView.as_view(), name='token_refresh_endpoint'),
      path('api/v/', send_verification_email, name='verify_endpoint'),
+     path('api/verify-email/<str:token>/', VerifyEmailView.as_view(), name='verify_email_endpoint'),
+     path('api/avatar/uploads/', AvatarUploadView.as_view(), name='avatar_upload_endpoint'),
+     path('api/avatar/uploads/<uuid:upload_id>/', AvatarUploadChunkView.as_view(), name='avatar_upload_chunk_endpoint'),
+     path('api/profiles/', ProfileList.as_view(), name='profiles_endpoint'),
+     path('api/profiles/<str:name>/', ProfileDetail.as_view(), name='profile_endpoint'),
+
+     # native async versions of the endpoints above, for ASGI deployments
+     path('api/async/login/', AsyncLoginView.as_view(), name='async_login_endpoint'),
+     path('api/async/logout/', AsyncLogoutView.as_view(), name='async_logout_endpoint'),
+     path('api/async/users/', AsyncUserList.as_view(), name='async_users_endpoint'),
+     path('api/async/signup/', AsyncRegistrationView.as_view(), name='async_signup_endpoint'),
 
 
 
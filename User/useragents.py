@@ -0,0 +1,119 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT_MAX_LENGTH = 255
+
+
+class UserAgentCollector:
+    """
+    Buffers (user, user agent) sightings in memory and writes them with bulk_create from a background thread
+    every ``flush_events`` sightings or ``flush_seconds``, whichever comes first. Repeated sightings of the
+    same pair within one window are written once.
+    """
+
+    def __init__(self, flush_events, flush_seconds, max_buffered):
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self._buffer = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def record(self, user_id, user_agent):
+        key = (user_id, (user_agent or '')[:USER_AGENT_MAX_LENGTH])
+        with self._lock:
+            if key not in self._buffer:
+                if len(self._buffer) >= self.max_buffered:
+                    self.dropped += 1
+                    return
+                self._buffer[key] = timezone.now()
+            full = len(self._buffer) >= self.flush_events
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='user-agent-flush', daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing user agent sightings failed')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self._lock:
+            batch, self._buffer = self._buffer, {}
+        if not batch:
+            return 0
+        try:
+            return self._write(batch)
+        except IntegrityError:
+            # Retrying would fail the same way.
+            logger.exception('Dropped %d user agent sightings', len(batch))
+            with self._lock:
+                self.dropped += len(batch)
+            return 0
+        except DatabaseError:
+            # Most likely transient (lost connection, lock wait timeout): keep the sightings for the next flush.
+            self._requeue(batch)
+            raise
+
+    def _requeue(self, batch):
+        with self._lock:
+            for key, seen_at in batch.items():
+                if key in self._buffer:
+                    self._buffer[key] = min(self._buffer[key], seen_at)
+                elif len(self._buffer) < self.max_buffered:
+                    self._buffer[key] = seen_at
+                else:
+                    self.dropped += 1
+
+    def _write(self, batch):
+        from .models import User, UserAgent, UserAgentInfo
+
+        values = {user_agent for _, user_agent in batch}
+        with transaction.atomic():
+            # Users deleted since their sighting would fail the whole insert on the foreign key.
+            users = set(User.objects.filter(pk__in={user_id for user_id, _ in batch}).values_list('pk', flat=True))
+            UserAgent.objects.bulk_create([UserAgent(value=value) for value in values], ignore_conflicts=True)
+            ids = dict(UserAgent.objects.filter(value__in=values).values_list('value', 'pk'))
+            for value in values - ids.keys():
+                # The column's collation folded this value into an existing row (case, accents, trailing
+                # spaces on MySQL); let the database find it the way it compared them.
+                ids[value] = UserAgent.objects.filter(value=value).values_list('pk', flat=True).first()
+            rows = UserAgentInfo.objects.bulk_create([
+                UserAgentInfo(user_id=user_id, user_agent_id=ids[user_agent], created_at=seen_at)
+                for (user_id, user_agent), seen_at in batch.items() if user_id in users
+            ], batch_size=self.flush_events)
+        return len(rows)
+
+
+collector = UserAgentCollector(settings.USER_AGENT_FLUSH_EVENTS, settings.USER_AGENT_FLUSH_SECONDS,
+                               settings.USER_AGENT_MAX_BUFFERED)
+
+
+@atexit.register
+def _flush_on_exit():
+    try:
+        collector.flush()
+    except Exception:
+        logger.exception('Flushing user agent sightings at exit failed')
+
+
+def record_user_agent(request, user):
+    collector.record(user.pk, request.META.get('HTTP_USER_AGENT', ''))
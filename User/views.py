@@ -9,53 +9,103 @@ from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from .forms import UserLoginForm, RegisterForm
-from .serializer import UserListSerializer, UserRegistrationSerializer
-from .models import User
+from .serializer import UserRegistrationSerializer, UserRowSerializer, \
+    DenylistTokenRefreshSerializer
+from .models import User, AvatarUpload, EmailVerificationToken
+from .authentication import user_cache
+from .denylist import denylist
+from .tokens import RefreshToken, get_token_service, issued_to
+from . import hashing, listcache, pagination, profiling, search, uploads
+from .useragents import record_user_agent, collector as user_agent_collector
+from .activity import collector as activity_collector
+from .metrics import registry
+from .ratelimit import client_ip, login_throttle
+from rest_framework.exceptions import Throttled
+from .mailer import queue_mail
 from rest_framework.views import APIView
 from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth.signals import user_logged_in
 from rest_framework import status
 from rest_framework.response import Response
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.core.mail import send_mail
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.views import TokenRefreshView
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils import timezone
+from rest_framework.permissions import AllowAny, IsAdminUser
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
 
 
-def get_tokens_for_user(user):
-    refresh = RefreshToken.for_user(user)
-    return {
-        'refresh': str(refresh),
-        'access': str(refresh.access_token),
-    }
+def get_tokens_for_user(user, refresh=True):
+    return get_token_service().tokens_for_user(user, refresh=refresh)
 
 
-def send_verification_email(user):
-    token = user.email_verification_token
+def start_session(request, user):
+    """
+    Log ``user`` into a Django session when AUTH_LOGIN_MODE is 'session'. In 'jwt' mode the client only gets
+    tokens, so no session row is written and no key rotated; user_logged_in still fires for last_login.
+    """
+    if settings.AUTH_LOGIN_MODE == 'session':
+        login(request, user)
+    else:
+        user_logged_in.send(sender=user.__class__, request=request, user=user)
+
+
+def access_only(data):
+    """True when a login asked for an access token only (no refresh token to mint, store or leak)."""
+    return str(data.get('access_only', '')).lower() in ('1', 'true', 'yes', 'on')
+
+
+def verification_email(user, token):
     verification_url = f"{settings.FRONTEND_URL}/verify-email/{token}/"
     subject = 'Verify your email address'
     message = f'Hi {user.username},\n\nPlease verify your email address by clicking on the following link: {verification_url}\n\nThank you!'
     from_email = settings.DEFAULT_FROM_EMAIL
     recipient_list = [user.email]
+    return subject, message, from_email, recipient_list
+
 
-    send_mail(subject, message, from_email, recipient_list)
+def send_verification_email(user):
+    queue_mail(*verification_email(user, EmailVerificationToken.issue(user)))
 
 
 class VerifyEmailView(APIView):
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
     def get(self, request, token):
-        user = get_object_or_404(User, email_verification_token=token)
-        if user.is_active:
+        with transaction.atomic():
+            verification = EmailVerificationToken.objects.select_for_update().filter(
+                token_hash=EmailVerificationToken.hash_token(token), expires_at__gt=timezone.now(),
+            ).values_list('user_id', 'user__is_active').first()
+            if verification is None:
+                raise Http404
+            user_id, is_active = verification
+            # Single use: the user's tokens go with the activation, so a replayed link cannot re-activate an
+            # account that was deactivated later.
+            EmailVerificationToken.objects.filter(user_id=user_id).delete()
+            if not is_active:
+                User.objects.filter(pk=user_id).update(is_active=True)
+        if is_active:
             return Response({'msg': 'Email already verified'}, status=status.HTTP_400_BAD_REQUEST)
 
-        user.is_active = True
-        user.email_verification_token = None
-        user.save()
+        user_cache.invalidate(user_id)
+        listcache.bump_version()
         return Response({'msg': 'Email verified successfully'}, status=status.HTTP_200_OK)
 
 
 class RegistrationView(APIView):
+    permission_classes = (AllowAny,)
+
     @swagger_auto_schema(
         operation_description="Create a new User",
         request_body=openapi.Schema(
@@ -78,22 +128,28 @@ class RegistrationView(APIView):
         }
     )
     def post(self, request):
-        serializer = UserRegistrationSerializer(data=request.data)
+        data = request.data
+        if getattr(request, 'upload_error', None):
+            return Response({'avatar': [request.upload_error]}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = UserRegistrationSerializer(data=data)
         if serializer.is_valid():
-            user = serializer.save()
-            send_verification_email(user)
-            tokens = get_tokens_for_user(user)
-            response_data = {
-                'user': serializer.data,
-                'tokens': tokens,
-            }
+            # The user, its verification token and the queued mail are written together or not at all.
+            with transaction.atomic():
+                user = serializer.save()
+                send_verification_email(user)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 class LogoutView(APIView):
     @swagger_auto_schema(
-        operation_description="User logout",
+        operation_description="User logout. Revokes the access token used and, if given, the refresh token",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'refresh': openapi.Schema(type=openapi.TYPE_STRING, description='Refresh token to revoke'),
+            },
+        ),
         responses={
             200: openapi.Response(
                 description="OK",
@@ -105,15 +161,35 @@ class LogoutView(APIView):
                 ),
             ),
             401: 'Unauthorized',
+            403: 'The refresh token was issued to another user',
             500: 'Internal Server Error',
         }
     )
     def post(self, request):
-        logout(request)
+        refresh = None
+        if request.data.get('refresh'):
+            try:
+                refresh = RefreshToken(request.data['refresh'])
+            except TokenError:
+                pass
+        if refresh is not None and not issued_to(refresh, request.user):
+            return Response({'msg': 'Refresh token was issued to another user'}, status=status.HTTP_403_FORBIDDEN)
+        if request.auth is not None:
+            denylist.revoke(request.auth)
+        if refresh is not None:
+            denylist.revoke(refresh)
+        if settings.AUTH_LOGIN_MODE == 'session':
+            logout(request)
         return Response({'msg': 'Successfully Logged out'}, status=status.HTTP_200_OK)
 
 
+class DenylistTokenRefreshView(TokenRefreshView):
+    serializer_class = DenylistTokenRefreshSerializer
+
+
 class LoginView(APIView):
+    permission_classes = (AllowAny,)
+
     @swagger_auto_schema(
         operation_description="User login",
         request_body=openapi.Schema(
@@ -121,6 +197,8 @@ class LoginView(APIView):
             properties={
                 'email': openapi.Schema(type=openapi.TYPE_STRING, description='User email'),
                 'password': openapi.Schema(type=openapi.TYPE_STRING, description='User password'),
+                'access_only': openapi.Schema(type=openapi.TYPE_BOOLEAN,
+                                              description='Return only an access token, no refresh token'),
             },
             required=['email', 'password'],
         ),
@@ -161,6 +239,8 @@ class LoginView(APIView):
                     },
                 ),
             ),
+            429: 'Too Many Requests (too many failed logins, see Retry-After)',
+            503: 'Service Unavailable (password hashing saturated, see Retry-After)',
         }
     )
     def post(self, request):
@@ -170,22 +250,40 @@ class LoginView(APIView):
         if not email or not password:
             return Response({'msg': 'Credentials missing'}, status=status.HTTP_400_BAD_REQUEST)
 
+        ip = client_ip(request)
+        wait = login_throttle.check(ip, email)
+        if wait is not None:
+            raise Throttled(wait=wait)
+
         user = authenticate(request, email=email, password=password)
 
         if user is not None:
-            login(request, user)
-            tokens = get_tokens_for_user(user)
+            login_throttle.succeeded(ip, email)
+            start_session(request, user)
+            record_user_agent(request, user)
+            tokens = get_tokens_for_user(user, refresh=not access_only(request.data))
             return Response({'msg': 'Login Success', 'tokens': tokens}, status=status.HTTP_200_OK)
 
+        login_throttle.failed(ip, email)
         return Response({'msg': 'Invalid Credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
 
 class UserList(APIView):
     @swagger_auto_schema(
-        operation_description="List Users",
+        operation_description="List Users, ordered by date joined. Follow the `Link` / `X-Next-Cursor` "
+                              "header for the next page, or pass `stream=ndjson|json` to stream every row.",
+        manual_parameters=[
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter('fields', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description='Comma separated: ' + ', '.join(pagination.LIST_FIELDS)),
+            openapi.Parameter('stream', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['ndjson', 'json']),
+            openapi.Parameter('avatar_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description='Pixel size of the avatar rendition returned in profile_photo_url'),
+        ],
         responses={
             200: openapi.Response(
-                description="OK",
+                description="OK. Carries an ETag and Last-Modified; send If-None-Match to get a 304 when unchanged.",
                 schema=openapi.Schema(
                     type=openapi.TYPE_ARRAY,
                     items=openapi.Schema(
@@ -210,9 +308,263 @@ class UserList(APIView):
         }
     )
     def get(self, request):
-        user = User.objects.all()
-        serializer = UserListSerializer(user, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        serializer = UserRowSerializer(pagination.parse_fields(request.query_params.get('fields')), request)
+        users = serializer.project(pagination.keyset(User.objects.all(), request.query_params.get('cursor')))
+
+        stream = request.query_params.get('stream')
+        if stream:
+            return pagination.stream_response(users, serializer, stream)
+
+        page_size = pagination.parse_page_size(request.query_params.get('page_size'))
+        key = listcache.cache_key(request)
+        entry = listcache.get(key)
+        if entry is None:
+            page = pagination.fetch_page(users, serializer, page_size)
+            entry = listcache.store(key, page, pagination.next_page_headers(request, page.next_cursor))
+        return listcache.respond(request, entry)
+
+
+class UserSearch(APIView):
+    @swagger_auto_schema(
+        operation_description="Search Users. `prefix` (typeahead) matches the start of the username, email or "
+                              "names, or of both names for two words; `fulltext` ranks matches over names, email, "
+                              "username and bio and pages through them with `cursor`.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('mode', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['prefix', 'fulltext']),
+            openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description='Next page of fulltext results'),
+            openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter('fields', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description='Comma separated: ' + ', '.join(pagination.LIST_FIELDS)),
+        ],
+        responses={
+            200: 'OK',
+            400: 'Bad Request',
+            401: 'Unauthorized',
+            500: 'Internal Server Error',
+        }
+    )
+    def get(self, request):
+        query = search.parse_query(request.query_params.get('q'))
+        serializer = UserRowSerializer(pagination.parse_fields(request.query_params.get('fields')), request)
+        mode = request.query_params.get('mode', 'prefix')
+        if mode == 'prefix':
+            page_size = pagination.parse_page_size(request.query_params.get('page_size'),
+                                                   settings.USER_SEARCH_TYPEAHEAD_SIZE)
+            page = search.typeahead_page(serializer, query, page_size)
+        elif mode == 'fulltext':
+            page_size = pagination.parse_page_size(request.query_params.get('page_size'))
+            page = search.fulltext_page(serializer, query, page_size, request.query_params.get('cursor'))
+        else:
+            return Response({'mode': 'Must be one of: prefix, fulltext'}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = HttpResponse(serializer.dumps(page.results), content_type='application/json')
+        for header, value in pagination.next_page_headers(request, page.next_cursor).items():
+            response[header] = value
+        return response
+
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def upload_status(upload):
+    return {'id': str(upload.pk), 'filename': upload.filename, 'size': upload.size, 'received': upload.received}
+
+
+class AvatarUploadView(APIView):
+    @swagger_auto_schema(
+        operation_description="Start a resumable avatar upload",
+        request_body=openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            required=['filename', 'size'],
+            properties={
+                'filename': openapi.Schema(type=openapi.TYPE_STRING),
+                'size': openapi.Schema(type=openapi.TYPE_INTEGER, description='Total size in bytes'),
+            }
+        ),
+        responses={
+            201: 'Created',
+            400: 'Bad Request',
+            401: 'Unauthorized',
+            413: 'Payload Too Large',
+        }
+    )
+    def post(self, request):
+        filename = request.data.get('filename', '')
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({'msg': 'size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        if extension not in uploads.AVATAR_EXTENSIONS:
+            return Response({'msg': 'Unsupported image format'}, status=status.HTTP_400_BAD_REQUEST)
+        if size < uploads.SNIFF_BYTES:
+            return Response({'msg': 'File is empty'}, status=status.HTTP_400_BAD_REQUEST)
+        if size > settings.AVATAR_MAX_UPLOAD_SIZE:
+            return Response({'msg': 'Image file too large'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        upload = AvatarUpload.objects.create(user=request.user, filename=filename, size=size)
+        return Response(upload_status(upload), status=status.HTTP_201_CREATED)
+
+
+class AvatarUploadChunkView(APIView):
+    def get_upload(self, request, upload_id, lock=False):
+        uploads_qs = AvatarUpload.objects.select_for_update() if lock else AvatarUpload.objects
+        return get_object_or_404(uploads_qs, pk=upload_id, user=request.user)
+
+    @swagger_auto_schema(operation_description="Resume point of an avatar upload")
+    def get(self, request, upload_id):
+        return Response(upload_status(self.get_upload(request, upload_id)), status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        operation_description="Append the bytes in the request body to an avatar upload. "
+                              "Send `Content-Range: bytes <start>-<end>/<size>` where start is the received offset.",
+        responses={
+            200: 'Upload complete',
+            202: 'Chunk stored',
+            400: 'Bad Request',
+            409: 'Offset mismatch, resume from `received`',
+            415: 'Unsupported image format',
+        }
+    )
+    def patch(self, request, upload_id):
+        match = CONTENT_RANGE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+        if not match:
+            return Response({'msg': 'Content-Range header required'}, status=status.HTTP_400_BAD_REQUEST)
+        start, end, total = (int(value) for value in match.groups())
+        if request.stream is None:
+            return Response({'msg': 'Empty chunk'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            upload = self.get_upload(request, upload_id, lock=True)
+            if total != upload.size or end < start or end >= upload.size:
+                return Response({'msg': 'Content-Range does not match the upload'}, status=status.HTTP_400_BAD_REQUEST)
+            if start != upload.received:
+                return Response(upload_status(upload), status=status.HTTP_409_CONFLICT)
+
+            try:
+                written = uploads.append_chunk(upload, request.stream, start, end - start + 1)
+            except uploads.MissingPart:
+                # The stored bytes were lost (purged or never written): the client starts over from 0.
+                upload.received = 0
+                upload.save(update_fields=['received', 'updated_at'])
+                return Response(upload_status(upload), status=status.HTTP_409_CONFLICT)
+            except ValueError as exc:
+                uploads.discard(upload)
+                upload.delete()
+                return Response({'msg': str(exc)}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+            upload.received = start + written
+            upload.save(update_fields=['received', 'updated_at'])
+
+        if upload.received < upload.size:
+            return Response(upload_status(upload), status=status.HTTP_202_ACCEPTED)
+
+        user = User.objects.get(pk=request.user.pk)
+        with open(uploads.part_path(upload), 'rb') as part:
+            user.avatar.save(upload.filename, uploads.PartialUploadFile(part), save=False)
+        user.save(update_fields=['avatar'])
+        uploads.discard(upload)
+        upload.delete()
+        return Response({'avatar': user.avatar.name}, status=status.HTTP_200_OK)
+
+
+# stats() keys that are current levels; every other key is a running total.
+GAUGE_STATS = frozenset({'size', 'maxsize', 'in_flight', 'hash_seconds_max', 'queue_seconds_max', 'entries',
+                         'buffered'})
+
+
+def _stats(prefix, stats):
+    return [(prefix + key, (), value, 'gauge' if key in GAUGE_STATS else 'counter') for key, value in stats.items()]
+
+
+def metrics_view(request):
+    if settings.METRICS_TOKEN:
+        if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {settings.METRICS_TOKEN}'):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    elif not settings.DEBUG:
+        raise Http404
+
+    extra = _stats('photo_auth_user_cache_', user_cache.stats())
+    extra += _stats('photo_password_hashing_', hashing.metrics.snapshot())
+    throttle = login_throttle.stats()
+    extra.append(('photo_login_throttle_checked', (), throttle['checked'], 'counter'))
+    extra += [('photo_login_throttle_rejected', (('scope', scope),), value, 'counter')
+              for scope, value in throttle['rejected'].items()]
+    extra.append(('photo_user_agent_sightings_dropped', (), user_agent_collector.dropped, 'counter'))
+    extra += _stats('photo_jwt_denylist_', denylist.stats())
+    extra += _stats('photo_login_activity_', activity_collector.stats())
+    return HttpResponse(registry.render(extra), content_type='text/plain; version=0.0.4')
+
+
+class ProfileList(APIView):
+    permission_classes = (IsAdminUser,)
+
+    @swagger_auto_schema(
+        operation_description="Request profiles kept by the sampling profiler, newest first (staff only).",
+        responses={
+            200: 'OK',
+            401: 'Unauthorized',
+            403: 'Forbidden',
+        }
+    )
+    def get(self, request):
+        return Response(profiling.store.list(), status=status.HTTP_200_OK)
+
+
+class ProfileDetail(APIView):
+    permission_classes = (IsAdminUser,)
+
+    @swagger_auto_schema(
+        operation_description="Download a profile as speedscope JSON (https://www.speedscope.app), or as "
+                              "collapsed stacks for flamegraph.pl with `output=collapsed` (staff only).",
+        manual_parameters=[
+            # Not `format`: DRF reads that one (URL_FORMAT_OVERRIDE) to pick a renderer and 404s on these values.
+            openapi.Parameter('output', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              enum=['speedscope', 'collapsed']),
+        ],
+        responses={
+            200: 'OK',
+            401: 'Unauthorized',
+            403: 'Forbidden',
+            404: 'Not Found',
+        }
+    )
+    def get(self, request, name):
+        path = profiling.store.path(name)
+        if path is None:
+            raise Http404
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            # Rotated out of the ring buffer since the lookup.
+            raise Http404
+        if request.query_params.get('output') == 'collapsed':
+            with f:
+                body = profiling.collapsed(json.load(f))
+            response = HttpResponse(body, content_type='text/plain; charset=utf-8')
+            response['Content-Disposition'] = f'attachment; filename="{name[:-len(".json")]}.collapsed.txt"'
+            return response
+        return FileResponse(f, as_attachment=True, filename=name, content_type='application/json')
+
+
+@lru_cache(maxsize=1)
+def _openapi_schema():
+    try:
+        return Path(settings.OPENAPI_SCHEMA_FILE).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def openapi_schema_view(request):
+    """The schema generated at build time, read once per process."""
+    schema = _openapi_schema()
+    if schema is None:
+        raise Http404
+    response = HttpResponse(schema, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=3600'
+    return response
 
 
 ## this section has no endpoint